@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_save, post_delete
 
 
 class AgenciesConfig(AppConfig):
     name = 'agencies'
+
+    def ready(self):
+        from agencies.esg import invalidate_active_esg
+        for model in [ self.get_model('EsgVersion'), self.get_model('EsgStandard') ]:
+            post_save.connect(invalidate_active_esg, sender=model, dispatch_uid=f'agencies-esg-{model.__name__}-save')
+            post_delete.connect(invalidate_active_esg, sender=model, dispatch_uid=f'agencies-esg-{model.__name__}-delete')
@@ -0,0 +1,43 @@
+"""
+registry of the active ESG version and its standards
+
+The standards are kept in memory by each process. A generation token in the shared cache
+is renewed whenever an ESG version or standard is saved or deleted, so that all processes
+reload them on their next access.
+"""
+
+from django.apps import apps
+
+from uni_db import generations
+
+GENERATION_KEY = 'agencies:esg:generation'
+
+_active = { }
+
+def get_generation():
+    return generations.get_generation(GENERATION_KEY)
+
+def invalidate_active_esg(*args, **kwargs):
+    generations.renew_generation(GENERATION_KEY)
+
+def _get_active():
+    generation = get_generation()
+    if _active.get('generation') != generation:
+        EsgVersion = apps.get_model('agencies', 'EsgVersion')
+        version = EsgVersion.objects.get(active=True)
+        standards = tuple(version.esgstandard_set.select_related('version'))
+        # replaced as a whole, so concurrent readers see either the old or the new state
+        _active.update(generation=generation, state=(version, standards))
+    return _active['state']
+
+def get_active_version():
+    """
+    the active EsgVersion
+    """
+    return _get_active()[0]
+
+def get_active_standards():
+    """
+    standards (EsgStandard) of the active version, in their default ordering
+    """
+    return _get_active()[1]
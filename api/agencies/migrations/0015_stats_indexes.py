@@ -0,0 +1,25 @@
+# Generated by Django 3.1.2 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('agencies', '0014_update_selectName'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='applications',
+            index=models.Index(fields=['decisionDate', 'stage'], name='applications_decision_stage'),
+        ),
+        migrations.AddIndex(
+            model_name='applications',
+            index=models.Index(fields=['reportSubmitted', 'stage'], name='applications_report_stage'),
+        ),
+        migrations.AddIndex(
+            model_name='applicationstandard',
+            index=models.Index(fields=['application', 'standard', 'rc'], name='applicationstandard_rc'),
+        ),
+    ]
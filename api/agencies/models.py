@@ -2,6 +2,7 @@ from django.core.exceptions import ValidationError, NON_FIELD_ERRORS
 from django.db import models
 from django.template.defaultfilters import slugify
 
+from agencies.esg import get_active_standards
 from contacts.models import Organisation, Contact, OctopusAccount, Country, ContactOrganisation
 from uni_db.fields import EnumField
 from uni_db.validators import validate_date_in_past
@@ -75,6 +76,8 @@ class EsgStandard(models.Model):
     number = models.CharField(max_length=3)
     title = models.CharField(max_length=255)
 
+    str_related = [ 'version' ]
+
     def __str__(self):
         label = f'{self.part}.{self.number} {self.title}'
         if not self.version.active:
@@ -116,6 +119,8 @@ class AgencyUpdate(models.Model):
     source = EnumField(choices=SOURCE_CHOICES)
     mtime = models.DateTimeField("last modified", auto_now=True)
 
+    str_related = [ 'agency', 'country' ]
+
     def __str__(self):
         return(f'{self.agency} {self.year} @ {self.country.iso3} ({self.type})')
 
@@ -253,31 +258,41 @@ class Applications(models.Model):
             previous_list = self.agency.applications_set.order_by('id')
         else:
             previous_list = self.agency.applications_set.filter(id__lt=self.id).order_by('id')
-        if previous_list.count() > 0:
-            self.previous = previous_list.last()
-        else:
-            self.previous = None
-        for esg in EsgVersion.objects.get(active=True).esgstandard_set.all():
+        self.previous = previous_list.last()
+        standards = get_active_standards()
+        for esg in standards:
             if self.previous and self.review in [ 'Focused', 'Targeted' ] and getattr(self, f'inherit_{esg.attribute_name}'):
                 setattr(self, f'panel_{esg.attribute_name}', getattr(self.previous, f'panel_{esg.attribute_name}'))
                 setattr(self, f'rapp_{esg.attribute_name}', getattr(self.previous, f'rapp_{esg.attribute_name}'))
                 setattr(self, f'rc_{esg.attribute_name}', getattr(self.previous, f'rc_{esg.attribute_name}'))
         super().save(*args, **kwargs)
-        for esg in EsgVersion.objects.get(active=True).esgstandard_set.all():
-            if getattr(self, f'panel_{esg.attribute_name}') or getattr(self, f'rapp_{esg.attribute_name}') or getattr(self, f'rc_{esg.attribute_name}'):
-                ApplicationStandard.objects.update_or_create(
-                    application=self,
-                    standard=esg,
-                    defaults=dict(
-                        panel=getattr(self, f'panel_{esg.attribute_name}'),
-                        rapporteurs=getattr(self, f'rapp_{esg.attribute_name}'),
-                        rc=getattr(self, f'rc_{esg.attribute_name}')
-                    )
-                )
+        self.sync_standards(standards)
+
+    def sync_standards(self, standards):
+        """
+        copies panel/rapporteurs/RC conclusions to ApplicationStandard, writing only the
+        records that are new or changed
+        """
+        existing = { obj.standard_id: obj for obj in self.applicationstandard_set.all() }
+        for esg in standards:
+            values = dict(
+                panel=getattr(self, f'panel_{esg.attribute_name}'),
+                rapporteurs=getattr(self, f'rapp_{esg.attribute_name}'),
+                rc=getattr(self, f'rc_{esg.attribute_name}')
+            )
+            if not any(values.values()):
+                continue
+            obj = existing.get(esg.id)
+            if obj is None:
+                ApplicationStandard.objects.create(application=self, standard=esg, **values)
+            elif any(getattr(obj, field) != value for field, value in values.items()):
+                for field, value in values.items():
+                    setattr(obj, field, value)
+                obj.save(update_fields=[ *values, 'mtime' ])
 
     def get_readonly_fields(self):
         readonly_fields = [ 'previous' ]
-        for esg in EsgVersion.objects.get(active=True).esgstandard_set.all():
+        for esg in get_active_standards():
             if getattr(self, f'inherit_{esg.attribute_name}'):
                 readonly_fields.append(f'panel_{esg.attribute_name}')
                 readonly_fields.append(f'rapp_{esg.attribute_name}')
@@ -303,7 +318,7 @@ class Applications(models.Model):
             require("reportDate", "Date must be specified.")
             require("reportSubmitted", "Date must be specified.")
         if self.stage >= '4': # waiting representation
-            for esg in EsgVersion.objects.get(active=True).esgstandard_set.all():
+            for esg in get_active_standards():
                 if not getattr(self, f'inherit_{esg.attribute_name}'):
                     require(f'panel_{esg.attribute_name}', "Must be specified.")
                     require(f'rapp_{esg.attribute_name}', "Must be specified.")
@@ -314,7 +329,7 @@ class Applications(models.Model):
             require("decisionDate", "Date must be specified.")
         if self.eligibilityDate and self.eligibilityDate < self.submitDate:
             errors["eligibilityDate"] = "Cannot be before submission date."
-        for esg in EsgVersion.objects.get(active=True).esgstandard_set.all():
+        for esg in get_active_standards():
             if getattr(self, f'inherit_{esg.attribute_name}') and self.review not in [ 'Focused', 'Targeted' ]:
                 errors[NON_FIELD_ERRORS] = "Inheriting compliance is only possible for focused or targeted reviews."
         if errors:
@@ -324,6 +339,12 @@ class Applications(models.Model):
         db_table = 'applications'
         ordering = [ '-id' ]
         verbose_name = 'application'
+        indexes = [
+            models.Index(fields=[ 'decisionDate', 'stage' ], name='applications_decision_stage'),
+            models.Index(fields=[ 'reportSubmitted', 'stage' ], name='applications_report_stage'),
+        ]
+
+    str_related = [ 'agency' ]
 
     def __str__(self):
         return(f'A{self.id} {self.agency} ({self.submitDate.year} {self.type}, {self.review})')
@@ -349,6 +370,11 @@ class ApplicationStandard(models.Model):
     class Meta:
         unique_together = ( ('application', 'standard'), )
         ordering = [ 'application', 'standard' ]
+        indexes = [
+            models.Index(fields=[ 'application', 'standard', 'rc' ], name='applicationstandard_rc'),
+        ]
+
+    str_related = [ 'standard', 'application' ]
 
     def __str__(self):
         return(f'{self.standard.short_name} @ {self.application}')
@@ -390,6 +416,8 @@ class ApplicationClarification(models.Model):
         verbose_name = 'clarification request'
         ordering = [ '-sentOn' ]
 
+    str_related = [ 'application' ]
+
     def __str__(self):
         return(f'{self.application} - {self.type}')
 
@@ -406,6 +434,8 @@ class ApplicationInterest(models.Model):
         verbose_name = 'conflict of interest (application)'
         verbose_name_plural = 'conflicts of interest (application)'
 
+    str_related = [ 'application', 'contact' ]
+
     def __str__(self):
         return(f'{self.application} - {self.contact}')
 
@@ -430,6 +460,8 @@ class ApplicationRole(models.Model):
         db_table = 'applicationRole'
         verbose_name = 'panel member'
 
+    str_related = [ 'application', 'contact' ]
+
     def __str__(self):
         return(f'{self.application} - {self.role}: {self.contact}')
 
@@ -470,6 +502,8 @@ class ChangeReport(models.Model):
         db_table = 'changeReport'
         verbose_name = 'Substantive Change Report'
 
+    str_related = [ 'agency' ]
+
     def __str__(self):
         return(f'C{self.id} {self.agency} ({self.submitDate.year})')
 
@@ -505,6 +539,8 @@ class Complaint(models.Model):
     class Meta:
         db_table = 'complaint'
 
+    str_related = [ 'agency' ]
+
     def __str__(self):
         return(f'CO{self.id} {self.agency}: {self.result or "(in progress)"}')
 
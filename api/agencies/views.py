@@ -81,6 +81,7 @@ class ApplicationStandardViewSet(UniModelViewSet):
     queryset = ApplicationStandard.objects.all()
     list_fields = [ 'application', 'standard', 'panel', 'rapporteurs', 'rc', 'keywords' ]
     search_fields = [ 'standard__title', 'application__agency__shortname', 'keywords', 'decision' ]
+    fulltext_search_fields = [ 'standard__title', 'keywords', 'decision' ]
     filterset_fields = {
         'application': [ 'exact' ],
         'standard': [ 'exact' ],
@@ -156,6 +156,8 @@ class ContactOrganisation(models.Model):
     function = models.CharField(max_length=255, blank=True, null=True)
     mtime = models.DateTimeField("last modified", auto_now=True)
 
+    str_related = [ 'contact', 'organisation' ]
+
     def __str__(self):
         return('{} <-> {}'.format(self.contact, self.organisation))
 
@@ -208,6 +210,8 @@ class DeqarConnectPartner(models.Model):
     notes = models.TextField(blank=True, null=True)
     mtime = models.DateTimeField("last modified", auto_now=True)
 
+    str_related = [ 'organisation' ]
+
     def __str__(self):
         return(f'P{self.id:02d} {self.organisation}')
 
@@ -241,6 +245,8 @@ class DeqarPartner(models.Model):
     notes = models.TextField(blank=True, null=True)
     mtime = models.DateTimeField("last modified", auto_now=True)
 
+    str_related = [ 'organisation' ]
+
     def __str__(self):
         return(f'P{self.id:02d} {self.organisation}')
 
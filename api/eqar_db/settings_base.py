@@ -39,13 +39,13 @@ INSTALLED_APPS = [
     'corsheaders',
     'django_probes',
 
-    'uni_db',
+    'uni_db.apps.UniDbConfig',
 
     'contacts',
     'members',
-    'agencies',
+    'agencies.apps.AgenciesConfig',
     'ldap_view',
-    'stats',
+    'stats.apps.StatsConfig',
 ]
 
 MIDDLEWARE = [
@@ -128,10 +128,11 @@ REST_FRAMEWORK = {
         'uni_db.permissions.IsSuperUser',
     ),
     'DEFAULT_RENDERER_CLASSES': (
-        'rest_framework.renderers.JSONRenderer',
+        'uni_db.renderers.JSONRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer',
-        'rest_framework_csv.renderers.PaginatedCSVRenderer',
+        'uni_db.renderers.PaginatedCSVRenderer',
         'stats.renderers.PaginatedInfogramJSONRenderer',
+        'uni_db.renderers.JSONLinesRenderer',
     ),
 #    'DEFAULT_VERSIONING_CLASS': 'rest_framework.versioning.NamespaceVersioning',
     'DEFAULT_PAGINATION_CLASS': 'uni_db.filters.SearchFacetPagination',
@@ -183,8 +184,55 @@ DEQAR_TOKEN = os.environ.get('DEQAR_TOKEN')
 # application title
 UNI_DB_TITLE = "EQAR Database"
 
-# cache time for statistics endpoints
-STATS_CACHE_MAX_AGE = 900
+# Caches shared by all worker processes, so that invalidation on data changes
+# reaches every worker - DJANGO_CACHE_DIR must be the same directory for all of them.
+# Generation tokens (see uni_db.generations) are kept apart from the entries they
+# invalidate, so that they are never culled.
+CACHE_DIR = os.environ.get('DJANGO_CACHE_DIR', '/tmp/eqar_db_cache')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(CACHE_DIR, 'default'),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('DJANGO_CACHE_MAX_ENTRIES', 50000)),
+        },
+    },
+    'generations': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(CACHE_DIR, 'generations'),
+        'OPTIONS': {
+            # a few tokens per model - far below this
+            'MAX_ENTRIES': 100000,
+        },
+    },
+}
+
+# cache time (HTTP) for statistics endpoints
+STATS_CACHE_MAX_AGE = 60
+
+# cache time for computed statistics - these are also invalidated whenever the
+# underlying data changes
+STATS_RESULT_CACHE_TIMEOUT = 86400
+
+# cache time for row counts of raw queries, used when paging through results
+RAW_QUERY_COUNT_CACHE_TIMEOUT = 60
+
+# cache time for raw query results - these are also invalidated whenever one of the
+# tables they refer to changes; larger results are not cached
+RAW_QUERY_RESULT_CACHE_TIMEOUT = 3600
+RAW_QUERY_RESULT_CACHE_MAX_ROWS = 10000
+
+# maximum execution time (seconds) of raw queries on MariaDB - queries can set a lower
+# limit for themselves
+RAW_QUERY_MAX_STATEMENT_TIME = 30
+
+# search terms shorter than this are not looked up in the full-text index (should match
+# innodb_ft_min_token_size of the database server)
+SEARCH_FULLTEXT_MIN_LENGTH = 3
+
+# number of threads (each with its own database connection) on which the independent
+# sheets of multi-sheet statistics are computed concurrently; 1 computes them one by one
+STATS_SHEET_WORKERS = 4
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
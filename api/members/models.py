@@ -47,6 +47,8 @@ class Invoice(models.Model):
     fee = models.DecimalField("membership fee", max_digits=7, decimal_places=2, blank=True, null=True)
     mtime = models.DateTimeField("last modified", auto_now=True)
 
+    str_related = [ 'member', 'account' ]
+
     def __str__(self):
         return('{}: {}€ @ {} '.format(self.member.name, self.fee, self.account))
 
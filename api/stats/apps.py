@@ -3,3 +3,12 @@ from django.apps import AppConfig
 
 class StatsConfig(AppConfig):
     name = 'stats'
+
+    def ready(self):
+        from stats.signals import connect_signals
+        connect_signals()
+        from stats import dimensions
+        dimensions.connect_signals()
+        from stats.views import ApplicationPrecedentList
+        from uni_db.search import register_views
+        register_views([ ApplicationPrecedentList ])
@@ -0,0 +1,122 @@
+"""
+X axis domains of stats views
+
+A Dimension is a list of X axis values - e.g. standards or contacts - together with their
+labels. It is kept in memory by each process instead of being queried on every request.
+A generation token per dimension in the shared cache is renewed whenever one of the
+models it depends on is saved or deleted, so that all processes reload it on their next
+access. Records of the values' own model (e.g. contacts) only renew it if they are one of
+the values and their label changed.
+"""
+
+from django.db.models import Count, Q
+from django.db.models.signals import post_save, post_delete
+
+from uni_db import generations
+
+from contacts.models import Contact, ContactOrganisation
+from agencies.models import ApplicationRole, EsgStandard, EsgVersion
+from agencies.esg import get_active_standards
+
+_dimensions = [ ]
+
+class Dimension:
+    """
+    X axis domain that can be used as x_range of a StatsView
+
+    name        - unique name, part of the cache key
+    get_values  - function returning the values, in the order of the X axis
+    models      - models the values depend on
+    label       - function turning a value to its label (default: str)
+    value_model - model of the values, if not in models (see value_changed)
+    """
+
+    def __init__(self, name, get_values, models, label=str, value_model=None):
+        self.name = name
+        self.get_values = get_values
+        self.models = models
+        self.label = label
+        self.value_model = value_model
+        self._state = None
+        _dimensions.append(self)
+
+    def _generation_key(self):
+        return f'stats:dimension:{self.name}:generation'
+
+    def get_generation(self):
+        return generations.get_generation(self._generation_key())
+
+    def invalidate(self, *args, **kwargs):
+        generations.renew_generation(self._generation_key())
+
+    def value_changed(self, sender, instance, signal, **kwargs):
+        """
+        invalidates the dimension if instance is one of the values and was deleted or its label
+        changed - or if this is unknown, because the values are not in memory in this process
+        """
+        state = self._state
+        if state is not None and state[0] == self.get_generation():
+            if instance.pk not in state[2]:
+                return
+            if signal is post_save and state[2][instance.pk] == self.label(instance):
+                return
+        self.invalidate()
+
+    def _get(self):
+        generation = self.get_generation()
+        state = self._state
+        if state is None or state[0] != generation:
+            values = tuple(self.get_values())
+            labels = { getattr(value, 'pk', value): self.label(value) for value in values }
+            # replaced as a whole, so concurrent readers see either the old or the new state
+            state = self._state = ( generation, values, labels )
+        return state
+
+    def __iter__(self):
+        return iter(self._get()[1])
+
+    def get_label(self, value):
+        return self._get()[2][getattr(value, 'pk', value)]
+
+def connect_signals():
+    for dimension in _dimensions:
+        for model in dimension.models:
+            post_save.connect(dimension.invalidate, sender=model, dispatch_uid=f'stats-dimension-{dimension.name}-{model.__name__}-save')
+            post_delete.connect(dimension.invalidate, sender=model, dispatch_uid=f'stats-dimension-{dimension.name}-{model.__name__}-delete')
+        if dimension.value_model:
+            model = dimension.value_model
+            post_save.connect(dimension.value_changed, sender=model, dispatch_uid=f'stats-dimension-{dimension.name}-{model.__name__}-save')
+            post_delete.connect(dimension.value_changed, sender=model, dispatch_uid=f'stats-dimension-{dimension.name}-{model.__name__}-delete')
+
+# standards of the active ESG version
+ESG_STANDARDS = Dimension(
+    'esg-standards',
+    get_active_standards,
+    [ EsgStandard, EsgVersion ],
+    label=lambda esg: esg.short_name,
+)
+
+# contacts who were on at least four review panels
+PANEL_MEMBERS = Dimension(
+    'panel-members',
+    lambda: Contact.objects.annotate(
+                review_count=Count(
+                    'application_role',
+                    filter=Q(applicationrole__role__in=[
+                        'Panel member',
+                        'Panel chair',
+                        'Panel secretary',
+                    ])
+                )
+            ).filter(review_count__gte=4),
+    [ ApplicationRole ],
+    value_model=Contact,
+)
+
+# RC members acting as rapporteurs
+RC_RAPPORTEURS = Dimension(
+    'rc-rapporteurs',
+    lambda: Contact.objects.filter(organisation=48, contactorganisation__function__startswith='RC'),
+    [ ContactOrganisation ],
+    value_model=Contact,
+)
@@ -2,6 +2,8 @@
 helper classes
 """
 
+from agencies.esg import get_active_standards
+
 class Esg:
     """
     A single ESG standard
@@ -46,13 +48,9 @@ class Esg:
 
 class EsgList(list):
     """
-    A list of ESG standards relevant for registration
+    A list of ESG standards relevant for registration, i.e. those of the active version
     """
 
     def __init__(self):
-        super().__init__()
-        for s in range(1,8):
-            self.append(Esg(2, s))
-        for s in range(1,7):
-            self.append(Esg(3, s))
+        super().__init__(Esg(standard.part, standard.number) for standard in get_active_standards())
 
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from stats.rollup import get_rollup
+
+class Command(BaseCommand):
+    help = 'Build the rollup of applications for the per-year stats, unless it is up to date'
+
+    def handle(self, *args, **options):
+        rows = get_rollup()
+        self.stdout.write(f'rollup: {len(rows)} rows, {sum(row["applications"] for row in rows)} applications')
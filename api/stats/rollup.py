@@ -0,0 +1,119 @@
+"""
+per-year rollup of applications for the stats views
+
+Applications are counted in one GROUP BY query by ( decision year, report year, type,
+review, result, stage ), together with the sums of durations relative to the report
+submission, the number of applications with clarification requests of each type and
+the number of each compliance level per standard.
+
+The rollup has a generation of its own (see stats.signals), i.e. it is rebuilt with a
+single query after applications or clarification requests changed, and then shared by
+all per-year views. The updatestatsrollup command builds it in advance.
+"""
+
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Sum, Exists, OuterRef, Q, F, ExpressionWrapper, DurationField
+from django.db.models.functions import ExtractYear
+from django.utils.text import slugify
+
+from agencies.models import Applications, ApplicationClarification
+
+from stats.signals import get_rollup_generation
+
+ROLLUP_KEYS = ( 'decision_year', 'report_year', 'type', 'review', 'result', 'stage' )
+
+DURATION_ZERO_DATE = 'reportSubmitted'
+DURATION_DATES = [ 'submitDate', 'eligibilityDate', 'sitevisitDate', 'reportDate', 'decisionDate' ]
+
+CLARIFICATION_TYPES = [ value for value, label in ApplicationClarification.TYPE_CHOICES ]
+
+RC_FIELDS = [ field.name for field in Applications._meta.fields if field.name.startswith('rc_') ]
+RC_LEVELS = [ value for value, label in Applications.EQAR_CHOICES ]
+
+_rollup = { }
+_lock = threading.Lock()
+
+def duration_measure(date):
+    return f'duration_{date}'
+
+def duration_count_measure(date):
+    return f'duration_{date}_count'
+
+def clarification_measure(request_type):
+    return f'clarification_{request_type.lower()}'
+
+def rc_measure(field, level):
+    return f'{field}_{slugify(level).replace("-", "_")}'
+
+def get_measures():
+    measures = { 'applications': Count('id') }
+    for date in DURATION_DATES:
+        measures[duration_measure(date)] = Sum(ExpressionWrapper(F(date) - F(DURATION_ZERO_DATE), output_field=DurationField()))
+        measures[duration_count_measure(date)] = Count(date)
+    for request_type in CLARIFICATION_TYPES:
+        measures[clarification_measure(request_type)] = Count('id', filter=Q(**{ f'_{clarification_measure(request_type)}': True }))
+    for field in RC_FIELDS:
+        for level in RC_LEVELS:
+            measures[rc_measure(field, level)] = Count('id', filter=Q(**{ field: level }))
+    return measures
+
+def build_rollup():
+    """
+    returns list( dict( [key or measure]: [value], ... ), ... ) with one row per combination
+    of ROLLUP_KEYS that occurs
+    """
+    clarifications = { f'_{clarification_measure(request_type)}':
+                            Exists(ApplicationClarification.objects.filter(application=OuterRef('pk'), type=request_type))
+                       for request_type in CLARIFICATION_TYPES }
+    return(list(Applications.objects.order_by()
+                                    .annotate(**clarifications)
+                                    .annotate(decision_year=ExtractYear('decisionDate'), report_year=ExtractYear('reportSubmitted'))
+                                    .values(*ROLLUP_KEYS)
+                                    .annotate(**get_measures())))
+
+def get_rollup():
+    """
+    rollup of the current generation, built if necessary
+    """
+    generation = get_rollup_generation()
+    state = _rollup.get('state')
+    if state is None or state[0] != generation:
+        # sheets computed concurrently (see StatsView.evaluate_sheets) wait for one build
+        with _lock:
+            state = _rollup.get('state')
+            if state is None or state[0] != generation:
+                key = f'stats:rollup:{generation}'
+                rows = cache.get(key)
+                if rows is None:
+                    rows = build_rollup()
+                    cache.set(key, rows, settings.STATS_RESULT_CACHE_TIMEOUT)
+                state = _rollup['state'] = ( generation, rows )
+    return state[1]
+
+def _matches(row, filters):
+    return all(row[key] in values for key, values in filters.items())
+
+def sum_rollup(by, **filters):
+    """
+    returns dict( [value of key by]: dict( [measure]: [sum], ... ), ... ) over the rows
+    where each key in filters has one of the values given as list
+    """
+    sums = { }
+    for row in get_rollup():
+        if row[by] is None or not _matches(row, filters):
+            continue
+        this = sums.setdefault(row[by], { })
+        for measure, value in row.items():
+            if measure in ROLLUP_KEYS or value is None:
+                continue
+            this[measure] = this[measure] + value if measure in this else value
+    return sums
+
+def get_last(by, **filters):
+    """
+    largest value of key by over the rows matching filters (see sum_rollup), or None
+    """
+    return max((row[by] for row in get_rollup() if row[by] is not None and _matches(row, filters)), default=None)
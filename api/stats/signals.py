@@ -0,0 +1,68 @@
+"""
+invalidation of cached stats results
+"""
+
+from django.db.models.signals import post_save, post_delete
+
+from uni_db import generations
+
+from contacts.models import Contact
+from agencies.models import \
+    Applications, \
+    RegisteredAgency, \
+    ApplicationStandard, \
+    ApplicationClarification, \
+    ApplicationRole, \
+    EsgStandard, \
+    EsgVersion
+
+# models that stats are computed from - any change invalidates all cached results
+#
+# Contacts only appear as X axis values (see stats.dimensions), which are invalidated on
+# their own, so that editing a contact does not throw away all stats.
+STATS_SOURCE_MODELS = [
+    Applications,
+    ApplicationStandard,
+    ApplicationClarification,
+    ApplicationRole,
+    RegisteredAgency,
+    EsgStandard,
+    EsgVersion,
+]
+
+# models the rollup (see stats.rollup) is computed from
+ROLLUP_SOURCE_MODELS = [
+    Applications,
+    ApplicationClarification,
+]
+
+GENERATION_KEY = 'stats:generation'
+ROLLUP_GENERATION_KEY = 'stats:rollup:generation'
+
+def get_generation():
+    """
+    current generation of cached stats - part of every cache key
+    """
+    return generations.get_generation(GENERATION_KEY)
+
+def get_rollup_generation():
+    return generations.get_generation(ROLLUP_GENERATION_KEY)
+
+def invalidate_stats(*args, **kwargs):
+    """
+    start a new generation, so that all previously cached stats are ignored
+    """
+    generations.renew_generation(GENERATION_KEY)
+
+def invalidate_rollup(*args, **kwargs):
+    generations.renew_generation(ROLLUP_GENERATION_KEY)
+
+def connect_signals():
+    for model in STATS_SOURCE_MODELS:
+        post_save.connect(invalidate_stats, sender=model, dispatch_uid=f'stats-{model.__name__}-save')
+        post_delete.connect(invalidate_stats, sender=model, dispatch_uid=f'stats-{model.__name__}-delete')
+    for model in ROLLUP_SOURCE_MODELS:
+        post_save.connect(invalidate_rollup, sender=model, dispatch_uid=f'stats-rollup-{model.__name__}-save')
+        post_delete.connect(invalidate_rollup, sender=model, dispatch_uid=f'stats-rollup-{model.__name__}-delete')
+    # deleting a contact clears it as rapporteur by an UPDATE, which sends no signal for applications
+    post_delete.connect(invalidate_stats, sender=Contact, dispatch_uid='stats-Contact-delete')
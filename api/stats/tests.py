@@ -1,3 +1,161 @@
-from django.test import TestCase
+import datetime
 
-# Create your tests here.
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from contacts.models import Contact, ContactOrganisation, Country, Organisation, Role
+from agencies.models import Applications, ApplicationClarification, ApplicationRole, EsgStandard, EsgVersion, RegisteredAgency
+
+from stats.views import \
+    ApplicationsDurationPerYear, \
+    ApplicationsTimeline, \
+    ClarificationRequestsByYearStats, \
+    ComplianceChangePerPanelStats, \
+    ComplianceChangePerRapporteurStats, \
+    ComplianceChangePerStandardStats, \
+    ComplianceChangeStats, \
+    ComplianceStats, \
+    ComplianceTimelineByStandard
+from stats.dimensions import PANEL_MEMBERS, RC_RAPPORTEURS
+from stats.signals import get_rollup_generation
+
+TEST_CACHES = {
+    'default': { 'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'stats-tests' },
+    'generations': { 'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'stats-tests-generations' },
+}
+
+@override_settings(CACHES=TEST_CACHES, STATS_SHEET_WORKERS=1)
+class StatsTestCase(TestCase):
+    """
+    a small set of applications with conclusions on all standards, panels and clarification requests
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        role = Role.objects.create(id=1, description='Agency')
+        country = Country.objects.create(iso3='BEL', iso2='BE', name='Belgium')
+        eqar = Organisation.objects.create(id=48, longname='EQAR', acronym='EQAR', role=role, country=country)
+        contacts = [ Contact.objects.create(firstName=f'First{i}', lastName=f'Last{i}', email=f'contact{i}@example.org') for i in range(10) ]
+        for contact in contacts[:4]:
+            ContactOrganisation.objects.create(contact=contact, organisation=eqar, function='RC member')
+        version = EsgVersion.objects.create(name='ESG 2015', active=True)
+        for part, number in [ ('2', n) for n in range(1, 8) ] + [ ('3', n) for n in range(1, 7) ]:
+            EsgStandard.objects.create(version=version, part=part, number=str(number), title=f'Standard {part}.{number}')
+        agencies = [ ]
+        for i in range(3):
+            organisation = Organisation.objects.create(longname=f'Agency {i}', acronym=f'AG{i}', role=role, country=country)
+            agencies.append(RegisteredAgency.objects.create(organisation=organisation, shortname=f'AG{i}', baseCountry=country, registered=True,
+                                                            registeredSince=datetime.date(2012, 1, 1), validUntil=datetime.date(2030, 1, 1)))
+        panel = [ value for value, label in Applications.PANEL_CHOICES ]
+        eqar_levels = [ value for value, label in Applications.EQAR_CHOICES ]
+        standards = list(EsgStandard.objects.filter(version=version))
+        for i in range(24):
+            # 2020 has no applications, so that empty years are covered
+            decided = datetime.date(2016 + i % 8 + (i % 8 >= 4), 1 + i % 12, 1 + i % 28)
+            stage = '-- Withdrawn' if i % 11 == 5 else '8. Completed'
+            application = Applications(agency=agencies[i % 3], type='Initial' if i % 3 else 'Renewal', review='Full', stage=stage,
+                                       result='Withdrawn' if stage == '-- Withdrawn' else ('Approved' if i % 4 else 'Rejected'),
+                                       submitDate=decided - datetime.timedelta(days=400), eligibilityDate=decided - datetime.timedelta(days=350),
+                                       sitevisitDate=decided - datetime.timedelta(days=200), reportDate=decided - datetime.timedelta(days=100),
+                                       reportSubmitted=decided - datetime.timedelta(days=90), reportExpected=decided, decisionDate=decided,
+                                       rapporteur1=contacts[i % 4], rapporteur2=contacts[(i + 1) % 4])
+            for j, esg in enumerate(standards):
+                if (i + j) % 5:
+                    setattr(application, f'panel_{esg.attribute_name}', panel[(i + j) % len(panel)])
+                    setattr(application, f'rc_{esg.attribute_name}', eqar_levels[(i * j) % len(eqar_levels)])
+            application.save()
+            for k, role_name in enumerate([ 'Panel member', 'Panel chair', 'Panel secretary' ]):
+                ApplicationRole.objects.create(application=application, contact=contacts[4 + (i + k) % 6], role=role_name)
+            if i % 3 == 0:
+                ApplicationClarification.objects.create(application=application, type=[ 'Panel', 'Agency', 'Coordinator', 'Other' ][i % 4],
+                                                        esg_2_1=True, esg_3_4=bool(i % 2), sentOn=decided)
+
+    def setUp(self):
+        for backend in caches.all():
+            backend.clear()
+
+    def get_view(self, view_class, **params):
+        view = view_class()
+        view.request = Request(APIRequestFactory().get('/', params))
+        view.format = None
+        return view
+
+class GroupedStatsTest(StatsTestCase):
+    """
+    grouped mode and the rollup must return the same as evaluating each X axis value
+    """
+
+    def assertSameStats(self, view_class, change, **params):
+        expected = self.get_view(view_class, **params)
+        change(expected)
+        self.assertEqual(self.get_view(view_class, **params).get_stats(), expected.get_stats())
+
+    def test_grouped_equals_per_x(self):
+        def per_x(view):
+            view.x_group = None
+            view.x_lookups = None
+        for view_class in [ ComplianceStats, ComplianceChangePerStandardStats, ComplianceChangePerPanelStats, ComplianceChangePerRapporteurStats ]:
+            for params in [ { }, { 'date_from': '2018-01-01', 'date_to': '2021-12-31' } ]:
+                with self.subTest(view=view_class.__name__, **params):
+                    self.assertSameStats(view_class, per_x, **params)
+
+    def test_rollup_equals_grouped(self):
+        def grouped(view):
+            view.rollup_x = None
+        for view_class in [ ApplicationsTimeline, ApplicationsDurationPerYear, ClarificationRequestsByYearStats, ComplianceTimelineByStandard ]:
+            with self.subTest(view=view_class.__name__):
+                self.assertSameStats(view_class, grouped)
+
+    def test_per_year_range(self):
+        stats = self.get_view(ComplianceChangeStats, date_from='2019-01-01', date_to='2021-12-31').get_stats()
+        self.assertEqual([ row['year'] for row in stats ], [ '2019', '2020', '2021' ])
+        self.assertEqual(stats[1]['total'], 0)
+
+    def test_empty_years(self):
+        stats = self.get_view(ClarificationRequestsByYearStats, date_from='2030-01-01', date_to='2031-12-31').get_stats()
+        self.assertEqual(len(stats), 2)
+        for row in stats:
+            self.assertEqual(row['total'], 0)
+            self.assertEqual(row['request_panel_share'], 0)
+
+class InvalidationTest(StatsTestCase):
+    """
+    contacts only invalidate the stats whose X axis they appear on, and only if their label changes
+    """
+
+    views = [ ComplianceStats, ComplianceChangePerPanelStats, ComplianceChangePerRapporteurStats ]
+
+    def get_keys(self):
+        return { view_class: self.get_view(view_class).get_cache_key() for view_class in self.views } | { 'rollup': get_rollup_generation() }
+
+    def assertInvalidated(self, change, *invalidated):
+        before = self.get_keys()
+        change()
+        after = self.get_keys()
+        self.assertEqual({ key for key in before if before[key] != after[key] }, set(invalidated))
+
+    def test_contact_changes(self):
+        rapporteur = Contact.objects.get(email='contact0@example.org')
+        list(PANEL_MEMBERS), list(RC_RAPPORTEURS)
+        rapporteur.postal = True
+        self.assertInvalidated(rapporteur.save)
+        rapporteur.lastName = 'Renamed'
+        self.assertInvalidated(rapporteur.save, ComplianceChangePerRapporteurStats)
+        list(RC_RAPPORTEURS)
+        other = Contact.objects.create(firstName='New', lastName='Contact')
+        other.lastName = 'Renamed'
+        self.assertInvalidated(other.save)
+
+    def test_values_not_in_memory(self):
+        # without the values in memory, a change cannot be told apart from an unchanged label
+        rapporteur = Contact.objects.get(email='contact0@example.org')
+        rapporteur.postal = True
+        self.assertInvalidated(rapporteur.save, ComplianceChangePerPanelStats, ComplianceChangePerRapporteurStats)
+
+    def test_rollup_sources(self):
+        application = Applications.objects.first()
+        self.assertInvalidated(application.save, 'rollup', *self.views)
+        role = ApplicationRole.objects.first()
+        self.assertInvalidated(role.save, *self.views)
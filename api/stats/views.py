@@ -1,7 +1,14 @@
 import datetime
+import hashlib
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
 from django.db.models import Count, Max, Q, F, ExpressionWrapper, DurationField, Avg
+from django.db.models.functions import ExtractYear
 from django.shortcuts import render
 from django.utils.decorators import method_decorator
 from django.views.decorators.cache import cache_control
@@ -9,19 +16,20 @@ from django.views.decorators.cache import cache_control
 from rest_framework import generics, status, views, viewsets, permissions, serializers
 from rest_framework.renderers import JSONRenderer, BrowsableAPIRenderer
 from rest_framework.response import Response
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
 
 from uni_db.filters import FilterBackend
+from uni_db.search import FullTextSearchFilter
 
-from contacts.models import Contact
 from agencies.models import \
     Applications, \
     RegisteredAgency, \
-    ApplicationStandard, \
-    EsgStandard, \
-    ApplicationRole
+    ApplicationStandard
 
+from stats.dimensions import Dimension, ESG_STANDARDS, PANEL_MEMBERS, RC_RAPPORTEURS
 from stats.helpers import Esg, EsgList
+from stats.rollup import sum_rollup, get_last, duration_measure, duration_count_measure, clarification_measure, rc_measure
+from stats.signals import get_generation
 from stats.serializers import ApplicationsListSerializer, ApplicationStandardListSerializer
 
 # toolbox
@@ -35,6 +43,23 @@ APPLICATION_DATE_FIELDS = [
     'decisionDate',
 ]
 
+COMPLIANCE_LEVELS = (
+    'Compliance',
+    'Partial compliance',
+    'Non-compliance',
+)
+
+def year_lookups(field, year, last=None):
+    """
+    lookups that restrict the date field to the given year (or years up to last) - as a
+    half-open date range, which the database can serve from an index, unlike the year of
+    the date
+    """
+    return {
+        f'{field}__gte': datetime.date(year, 1, 1),
+        f'{field}__lt': datetime.date((last or year) + 1, 1, 1),
+    }
+
 
 class DateRangeFilterMixin:
     """
@@ -100,13 +125,34 @@ class StatsView(DateRangeFilterMixin, views.APIView):
     These attributed should be defined in subclass, or the get_xyz() methods overwritten:
 
     queryset     - Queryset from which stats are generated
-    x_range      - X axis range
+    x_range      - X axis range, preferably a Dimension (see stats.dimensions)
     field_labels - dict( [field name]: [column label], ... )
 
     Optional field:
     x_name       - field that takes X axis value (default: first field name)
+
+    Grouped-aggregation mode - used if x_group is set:
+    x_group      - field name or expression by which the queryset is grouped; the values
+                   must match x_to_key() of the X axis values
+    measures     - dict( [field name]: [aggregate expression], ... )
+
+    In grouped mode the whole table is computed in one GROUP BY query and reshaped
+    along the X axis, instead of running filter_queryset_by_x() and stats() for each
+    X axis value.
+
+    Per-year views may instead take grouped stats from the rollup of applications (see
+    stats.rollup), as long as no date filter is applied:
+    rollup_x     - rollup key by which the view is grouped (e.g. 'decision_year')
+    rollup_filter - dict( [rollup key]: [list of values], ... ) selecting the rows
+    rollup_to_measures() - turns the summed rollup measures into the view's measures
+
+    Results of get_stats() are cached per view and query parameters (independent of
+    the output format) until the underlying data changes, see stats.signals.
     """
     permission_classes = [ ] # default is public
+    x_group = None
+    rollup_x = None
+    rollup_filter = { }
 
     def _default_get(self, attribute, default=None):
         if hasattr(self, attribute):
@@ -149,16 +195,86 @@ class StatsView(DateRangeFilterMixin, views.APIView):
     def stats(self, filtered_qs, x, **kwargs):
         """
         return stats using a filtered queryset - should return a dict
+
+        by default, the measures are evaluated as one aggregate query
+        """
+        return self.finalize_stats(filtered_qs.aggregate(**self.get_measures(**kwargs)), x, **kwargs)
+
+    def get_x_group(self, **kwargs):
+        return self.x_group
+
+    def get_measures(self, **kwargs):
+        return self._default_get('measures')
+
+    def get_grouped_queryset(self, **kwargs):
+        """
+        queryset that is grouped by x_group - can be overwritten if needed
+        """
+        return self.get_queryset().filter(**kwargs)
+
+    def finalize_stats(self, values, x, **kwargs):
+        """
+        post-process the aggregated measures (e.g. shares, unit conversion) - can be overwritten if needed
+        """
+        return values
+
+    def x_to_key(self, x):
+        """
+        turn X axis value to the key it is grouped by - can be overwritten if needed
         """
-        raise NotImplementedError('function stats() must be implemented')
+        return getattr(x, 'pk', x)
 
     def x_to_str(self, x):
         """
         turn X axis value to label - can be overwritten if needed
         """
+        x_range = getattr(self, 'x_range', None)
+        if isinstance(x_range, Dimension):
+            return x_range.get_label(x)
         return str(x)
 
+    def use_rollup(self, **kwargs):
+        """
+        whether grouped stats are taken from the rollup - only possible without date filters
+        """
+        return self.rollup_x is not None and self._parse_date('date_from') is None and self._parse_date('date_to') is None
+
+    def rollup_to_measures(self, values, **kwargs):
+        """
+        turn the summed rollup measures of an X axis value to the measures of the view
+        """
+        raise NotImplementedError('function rollup_to_measures() must be implemented if rollup_x is set')
+
+    def grouped_stats(self, **kwargs):
+        """
+        run one GROUP BY query for all measures, returns dict( [x key]: [measures], ... )
+        """
+        if self.use_rollup(**kwargs):
+            return { x: self.rollup_to_measures(values, **kwargs) for x, values in sum_rollup(self.rollup_x, **self.rollup_filter).items() }
+        x_group = self.get_x_group(**kwargs)
+        if isinstance(x_group, str):
+            x_group = F(x_group)
+        rows = self.get_grouped_queryset(**kwargs) \
+                    .order_by() \
+                    .annotate(_x=x_group) \
+                    .values('_x') \
+                    .annotate(**self.get_measures(**kwargs))
+        return { row.pop('_x'): row for row in rows }
+
+    def iterate_over_groups(self, **kwargs):
+        groups = self.grouped_stats(**kwargs)
+        # measures for X axis values without any data (evaluated without a query)
+        empty = self.get_grouped_queryset(**kwargs).none().aggregate(**self.get_measures(**kwargs))
+        stats = [ ]
+        for x in self.get_x_range():
+            this = self.finalize_stats(dict(groups.get(self.x_to_key(x), empty)), x, **kwargs)
+            this[self.get_x_name()] = self.x_to_str(x)
+            stats.append(this)
+        return stats
+
     def iterate_over_x(self, **kwargs):
+        if self.get_x_group(**kwargs) is not None:
+            return self.iterate_over_groups(**kwargs)
         stats = [ ]
         for x in self.get_x_range():
             this = self.stats(self.filter_queryset_by_x(x, **kwargs), x, **kwargs)
@@ -169,10 +285,51 @@ class StatsView(DateRangeFilterMixin, views.APIView):
     def get_stats(self):
         return self.iterate_over_x()
 
+    def evaluate_sheets(self, sheets):
+        """
+        evaluate independent sheets, given as dict( [sheet name]: [function], ... ), returns
+        dict( [sheet name]: [stats], ... ) in the same order
+
+        The sheets are computed concurrently on up to STATS_SHEET_WORKERS threads.
+        """
+        workers = min(settings.STATS_SHEET_WORKERS, len(sheets))
+        if workers <= 1:
+            return { name: sheet() for name, sheet in sheets.items() }
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = { name: executor.submit(self._evaluate_sheet, sheet) for name, sheet in sheets.items() }
+            return { name: future.result() for name, future in futures.items() }
+
+    def _evaluate_sheet(self, sheet):
+        try:
+            return sheet()
+        finally:
+            # each thread opens its own connection, which must not be left open in the pool
+            connection.close()
+
+    def get_cache_key(self):
+        params = sorted(
+            (name, values) for name, values in self.request.query_params.lists() if name != 'format'
+        )
+        digest = hashlib.md5(repr(params).encode()).hexdigest()
+        generation = get_generation()
+        x_range = getattr(self, 'x_range', None)
+        if isinstance(x_range, Dimension):
+            # contacts, for instance, only invalidate the dimensions they appear in
+            generation = f'{generation}:{x_range.get_generation()}'
+        return f'stats:{generation}:{self.__class__.__name__}:{digest}'
+
+    def get_cached_stats(self):
+        key = self.get_cache_key()
+        stats = cache.get(key)
+        if stats is None:
+            stats = self.get_stats()
+            cache.set(key, stats, settings.STATS_RESULT_CACHE_TIMEOUT)
+        return stats
+
     def get(self, request, format=None):
         self.request = request
         self.format = format
-        return Response(self.get_stats(), status=status.HTTP_200_OK)
+        return Response(self.get_cached_stats(), status=status.HTTP_200_OK)
 
     def finalize_response(self, request, response, *args, **kwargs):
         # Error responses carry a DRF error dict that the CSV renderer can't tabulate
@@ -192,7 +349,12 @@ class PerYearStatsView(StatsView):
     Year-axis range is clamped to the calendar years touched by ?date_from / ?date_to:
     years outside the window are dropped, years inside it with no matching data still
     appear as zero-count rows.
+
+    year_field   - date field by which records are assigned to years; in grouped mode, the
+                   queryset is restricted to the years of the X axis by a range on it
     """
+    year_field = None
+    _x_range = None
 
     def get_year_start(self):
         df = self._parse_date('date_from')
@@ -203,7 +365,17 @@ class PerYearStatsView(StatsView):
             self._default_get('year_last', datetime.date.today().year))
 
     def get_x_range(self):
-        return range(self.get_year_start(), self.get_year_last() + 1)
+        # kept, as the last year may take a query and the range is needed for filtering as well
+        if self._x_range is None:
+            self._x_range = range(self.get_year_start(), self.get_year_last() + 1)
+        return self._x_range
+
+    def get_grouped_queryset(self, **kwargs):
+        queryset = super().get_grouped_queryset(**kwargs)
+        if self.year_field:
+            years = self.get_x_range()
+            queryset = queryset.filter(**year_lookups(self.year_field, years.start, years.stop - 1))
+        return queryset
 
 # these views are primarily for the EQAR website
 
@@ -236,7 +408,7 @@ class ApplicationPrecedentList(generics.ListAPIView):
     permission_classes = [ permissions.IsAuthenticated ]
     queryset = ApplicationStandard.objects.exclude(keywords__isnull=True, decision__isnull=True)
     serializer_class = ApplicationStandardListSerializer
-    filter_backends = [FilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [FilterBackend, FullTextSearchFilter, OrderingFilter]
     filterset_fields = {
         'application__agency': [ 'exact' ],
         'application__agency__baseCountry': [ 'exact' ],
@@ -249,6 +421,7 @@ class ApplicationPrecedentList(generics.ListAPIView):
         'panel': [ 'exact' ],
     }
     search_fields = [ 'standard__title', 'application__agency__shortname', 'keywords', 'decision' ]
+    fulltext_search_fields = [ 'standard__title', 'keywords', 'decision' ]
 
 # following views are primarily for datawrapper.io charts
 
@@ -264,18 +437,20 @@ class ApplicationsTimeline(PerYearStatsView):
             'applications': 'Decisions on applications',
             'agencies': 'Registered agencies',
         }
+    year_field = 'decisionDate'
+    x_group = ExtractYear('decisionDate')
+    measures = { 'applications': Count('id') }
+    rollup_x = 'decision_year'
 
-    def filter_queryset_by_x(self, year, **kwargs):
-        return self.get_queryset().filter(decisionDate__year=year)
+    def rollup_to_measures(self, values, **kwargs):
+        return { 'applications': values['applications'] }
 
-    def stats(self, filtered_qs, year, **kwargs):
+    def finalize_stats(self, values, year, **kwargs):
         first = datetime.date(year, 1, 1)
         last = datetime.date(year, 12, 31)
-        return({
-            'applications': filtered_qs.count(),
-            'agencies': RegisteredAgency.objects.filter(registeredSince__lte=last, validUntil__gte=first).count() if year != self.get_year_last()
-                        else RegisteredAgency.objects.filter(registered=True).count(),
-        })
+        values['agencies'] = RegisteredAgency.objects.filter(registeredSince__lte=last, validUntil__gte=first).count() if year != self.get_year_last() \
+                             else RegisteredAgency.objects.filter(registered=True).count()
+        return values
 
 
 class ApplicationsTotals(StatsView):
@@ -290,6 +465,11 @@ class ApplicationsTotals(StatsView):
             'initial': 'Initial applications',
             'renewal': 'Renewal applications',
         }
+    x_group = 'result'
+    measures = {
+            'initial': Count('id', filter=Q(type='Initial')),
+            'renewal': Count('id', filter=Q(type='Renewal')),
+        }
 
     def get_x_range(self):
         return [ i['result'] for i in self.get_queryset().order_by().values('result').distinct() ]
@@ -297,12 +477,6 @@ class ApplicationsTotals(StatsView):
     def filter_queryset_by_x(self, x, **kwargs):
         return self.get_queryset().filter(result=x)
 
-    def stats(self, filtered_qs, x, **kwargs):
-        return {
-            'initial': filtered_qs.filter(type='Initial').count(),
-            'renewal': filtered_qs.filter(type='Renewal').count(),
-        }
-
 
 class ComplianceStats(StatsView):
     """
@@ -312,26 +486,17 @@ class ComplianceStats(StatsView):
     date_filter_fields = APPLICATION_DATE_FIELDS
     date_filter_field_prefix = 'application__'
     date_filter_default = 'decisionDate'
-    x_range = EsgStandard.objects.filter(version__active=True)
+    x_range = ESG_STANDARDS
     field_labels = (
             'standard',
-            'Compliance',
-            'Partial compliance',
-            'Non-compliance',
+            *COMPLIANCE_LEVELS,
         )
+    x_group = 'standard'
+    measures = { compliance: Count('id', filter=Q(rc=compliance)) for compliance in COMPLIANCE_LEVELS }
 
     def filter_queryset_by_x(self, esg, **kwargs):
         return self.get_queryset().filter(standard=esg, **kwargs)
 
-    def x_to_str(self, esg):
-        return esg.short_name
-
-    def stats(self, filtered_qs, esg, *args, **kwargs):
-        stats = {}
-        for compliance in ('Compliance', 'Partial compliance', 'Non-compliance'):
-            stats[compliance] = filtered_qs.filter(rc=compliance).count()
-        return stats
-
 
 class ComplianceExtendedStats(ComplianceStats):
     """
@@ -341,16 +506,16 @@ class ComplianceExtendedStats(ComplianceStats):
         last = self.get_queryset().aggregate(last=Max('application__decisionDate'))['last']
         last_year = last.year if last else datetime.date.today().year
         year_range = range(2016, self._resolve_year_last(last_year) + 1)
-        stats = {
-            'All': self.iterate_over_x()
+        sheets = {
+            'All': self.iterate_over_x
         }
         for application_type in ('Initial', 'Renewal'):
-            stats[application_type] = self.iterate_over_x(application__type=application_type)
+            sheets[application_type] = partial(self.iterate_over_x, application__type=application_type)
         for result in ('Approved', 'Rejected'):
-            stats[result] = self.iterate_over_x(application__result=result)
+            sheets[result] = partial(self.iterate_over_x, application__result=result)
         for year in year_range:
-            stats[year] = self.iterate_over_x(application__decisionDate__year=year)
-        return stats
+            sheets[year] = partial(self.iterate_over_x, **year_lookups('application__decisionDate', year))
+        return self.evaluate_sheets(sheets)
 
 
 class ComplianceChangeMixin:
@@ -379,13 +544,44 @@ class ComplianceChangeMixin:
     Q_upgrade =     ( Q(panel='Non-compliance') & ~Q(rc='Non-compliance') ) | \
                     Q(panel='Partial compliance', rc='Compliance')
 
-    def stats(self, filtered_qs, *args, **kwargs):
-        this = {
-            'total':        filtered_qs.count(),
-            'identical':    filtered_qs.filter(self.Q_identical).count(),
-            'downgrade':    filtered_qs.filter(self.Q_downgrade).count(),
-            'upgrade':      filtered_qs.filter(self.Q_upgrade).count(),
-        }
+    measures = {
+        'total':        Count('id'),
+        'identical':    Count('id', filter=Q_identical),
+        'downgrade':    Count('id', filter=Q_downgrade),
+        'upgrade':      Count('id', filter=Q_upgrade),
+    }
+
+    # the same classification as lookup table: panel's conclusion -> RC decision, in order of EQAR_CHOICES
+    change_matrix = {
+        'Compliance':               ( 'identical',  'downgrade',    'downgrade' ),
+        'Full compliance':          ( 'identical',  'downgrade',    'downgrade' ),
+        'Substantial compliance':   ( 'identical',  'downgrade',    'downgrade' ),
+        'Partial compliance':       ( 'upgrade',    'identical',    'downgrade' ),
+        'Non-compliance':           ( 'upgrade',    'upgrade',      'identical' ),
+    }
+    changes = { (panel, rc): change for panel, row in change_matrix.items() for (rc, label), change in zip(Applications.EQAR_CHOICES, row) }
+
+    # lookups of the X axis value (a contact) - if set, conclusions are fetched once and classified in memory
+    x_lookups = None
+
+    def get_x_group(self, **kwargs):
+        return self.x_lookups or super().get_x_group(**kwargs)
+
+    def grouped_stats(self, **kwargs):
+        if not self.x_lookups:
+            return super().grouped_stats(**kwargs)
+        groups = { }
+        for panel, rc, *keys in self.get_grouped_queryset(**kwargs).order_by().values_list('panel', 'rc', *self.x_lookups):
+            change = self.changes.get((panel, rc))
+            # a conclusion counts once for each X axis value it is related to
+            for key in set(keys) - { None }:
+                this = groups.setdefault(key, dict.fromkeys(self.measures, 0))
+                this['total'] += 1
+                if change:
+                    this[change] += 1
+        return groups
+
+    def finalize_stats(self, this, *args, **kwargs):
         for i in ('identical','downgrade','upgrade'):
             this[f'{i}_share'] = this[i] / this['total'] if this['total'] else 0
         return this
@@ -397,41 +593,36 @@ class ComplianceChangeStats(ComplianceChangeMixin, PerYearStatsView):
     """
     year_start = 2016
     field_labels = { 'year': 'Year', **ComplianceChangeMixin.field_labels }
+    year_field = 'application__decisionDate'
+    x_group = ExtractYear('application__decisionDate')
 
     def get_year_last(self):
-        last = self.get_queryset().aggregate(last=Max('application__decisionDate'))['last']
+        last = self.get_queryset().aggregate(last=Max(self.year_field))['last']
         return self._resolve_year_last(last.year if last else datetime.date.today().year)
 
-    def filter_queryset_by_x(self, year, **kwargs):
-        return self.get_queryset().filter(application__decisionDate__year=year)
-
 
 class ComplianceChangePerStandardStats(ComplianceChangeMixin, StatsView):
     """
     statistics on change to panel's conclusion per standard - by standard
     """
     field_labels = { 'standard': 'Standard', **ComplianceChangeMixin.field_labels }
-    x_range = EsgStandard.objects.filter(version__active=True)
+    x_range = ESG_STANDARDS
+    x_group = 'standard'
 
     def filter_queryset_by_x(self, esg, **kwargs):
         return self.get_queryset().filter(standard=esg)
 
+    def x_to_str(self, esg):
+        return str(esg)
+
 
 class ComplianceChangePerPanelStats(ComplianceChangeMixin, StatsView):
     """
     statistics on change to panel's conclusion - by panel members
     """
     field_labels = { 'person': 'Panel member', **ComplianceChangeMixin.field_labels }
-    x_range = Contact.objects.annotate(
-                    review_count=Count(
-                        'application_role',
-                        filter=Q(applicationrole__role__in=[
-                            'Panel member',
-                            'Panel chair',
-                            'Panel secretary',
-                        ])
-                    )
-                ).filter(review_count__gte=4)
+    x_range = PANEL_MEMBERS
+    x_lookups = [ 'application__roles' ]
 
     def filter_queryset_by_x(self, contact, **kwargs):
         return self.get_queryset().filter(application__roles=contact)
@@ -442,7 +633,8 @@ class ComplianceChangePerRapporteurStats(ComplianceChangeMixin, StatsView):
     statistics on change to panel's conclusion - by RC rapporteurs
     """
     field_labels = { 'person': 'RC rapporteur', **ComplianceChangeMixin.field_labels }
-    x_range = Contact.objects.filter(organisation=48, contactorganisation__function__startswith='RC')
+    x_range = RC_RAPPORTEURS
+    x_lookups = [ 'application__rapporteur1', 'application__rapporteur2' ]
 
     def filter_queryset_by_x(self, contact, **kwargs):
         return self.get_queryset().filter(Q(application__rapporteur1=contact) | Q(application__rapporteur2=contact))
@@ -453,6 +645,7 @@ class ApplicationStatsMixin:
     common queryset for most application statistics
     """
     queryset = Applications.objects.filter(Q(stage='-- Withdrawn') | Q(stage='8. Completed'))
+    rollup_filter = { 'stage': [ '-- Withdrawn', '8. Completed' ] }
 
 class ApplicationByYearMixin:
     """
@@ -461,13 +654,17 @@ class ApplicationByYearMixin:
     year_start = 2016
     date_filter_fields = APPLICATION_DATE_FIELDS
     date_filter_default = 'decisionDate'
+    year_field = 'decisionDate'
+    x_group = ExtractYear('decisionDate')
+    rollup_x = 'decision_year'
 
     def get_year_last(self):
-        last = self.get_queryset().aggregate(last=Max('decisionDate'))['last']
-        return self._resolve_year_last(last.year if last else datetime.date.today().year)
-
-    def filter_queryset_by_x(self, year, **kwargs):
-        return self.get_queryset().filter(decisionDate__year=year)
+        if self.use_rollup():
+            last_year = get_last(self.rollup_x, **self.rollup_filter)
+        else:
+            last = self.get_queryset().aggregate(last=Max(self.year_field))['last']
+            last_year = last.year if last else None
+        return self._resolve_year_last(last_year or datetime.date.today().year)
 
 class ApplicationDurationMixin:
     """
@@ -498,14 +695,15 @@ class ApplicationDurationMixin:
             b = self.zero_date
         return ExpressionWrapper(F(a)-F(b), output_field=DurationField())
 
-    def stats(self, filtered_qs, year, **kwargs):
+    def get_measures(self, **kwargs):
         # generate annotation expressions for timedeltas
-        aggregate_kwargs = { }
+        measures = { }
         for date in self.include_dates:
             if date != self.zero_date:
-                aggregate_kwargs[f'd_{date}'] = Avg(self._timedelta(date))
-        # run query and transform values to ordinary list
-        values = filtered_qs.aggregate(**aggregate_kwargs)
+                measures[f'd_{date}'] = Avg(self._timedelta(date))
+        return measures
+
+    def finalize_stats(self, values, x, **kwargs):
         values[f'd_{self.zero_date}'] = 0
         # convert timedeltas to days
         for date in self.include_dates:
@@ -548,13 +746,18 @@ class ApplicationsDurationPerYear(ApplicationDurationMixin, ApplicationStatsMixi
     zero_date = 'reportSubmitted'
     date_filter_default = 'reportSubmitted'
     field_labels = { 'year': 'Year', **ApplicationDurationMixin.field_labels }
+    year_field = 'reportSubmitted'
+    x_group = ExtractYear('reportSubmitted')
+    rollup_x = 'report_year'
 
-    def get_year_last(self):
-        last = self.get_queryset().aggregate(last=Max('reportSubmitted'))['last']
-        return self._resolve_year_last(last.year if last else datetime.date.today().year)
-
-    def filter_queryset_by_x(self, year, **kwargs):
-        return self.get_queryset().filter(reportSubmitted__year=year)
+    def rollup_to_measures(self, values, **kwargs):
+        # the rollup has durations relative to reportSubmitted, i.e. zero_date
+        measures = { }
+        for date in self.include_dates:
+            if date != self.zero_date:
+                count = values.get(duration_count_measure(date))
+                measures[f'd_{date}'] = values[duration_measure(date)] / count if count else None
+        return measures
 
 
 class ClarificationRequestStatsMixin:
@@ -573,16 +776,20 @@ class ClarificationRequestStatsMixin:
             'request_other_share': 'Requests to others (percentage)',
         }
 
-    def stats(self, filtered_qs, x, **kwargs):
-        this = {
-            'total':                filtered_qs.count(),
-            'request_panel':        filtered_qs.filter(applicationclarification__type='Panel', **kwargs).distinct().count(),
-            'request_coordinator':  filtered_qs.filter(applicationclarification__type='Coordinator', **kwargs).distinct().count(),
-            'request_agency':       filtered_qs.filter(applicationclarification__type='Agency', **kwargs).distinct().count(),
-            'request_other':        filtered_qs.filter(applicationclarification__type='Other', **kwargs).distinct().count(),
+    def get_measures(self, **kwargs):
+        def requests(request_type):
+            return Count('id', filter=Q(applicationclarification__type=request_type, **kwargs), distinct=True)
+        return {
+            'total':                Count('id', distinct=True),
+            'request_panel':        requests('Panel'),
+            'request_coordinator':  requests('Coordinator'),
+            'request_agency':       requests('Agency'),
+            'request_other':        requests('Other'),
         }
+
+    def finalize_stats(self, this, x, **kwargs):
         for t in ('panel','coordinator','agency','other'):
-            this[f'request_{t}_share'] = this[f'request_{t}'] / this['total']
+            this[f'request_{t}_share'] = this[f'request_{t}'] / this['total'] if this['total'] else 0
         return this
 
 
@@ -592,6 +799,12 @@ class ClarificationRequestsByYearStats(ClarificationRequestStatsMixin, Applicati
     """
     field_labels = { 'year': 'Year', **ClarificationRequestStatsMixin.field_labels }
 
+    def rollup_to_measures(self, values, **kwargs):
+        measures = { 'total': values['applications'] }
+        for request_type in ('Panel','Coordinator','Agency','Other'):
+            measures[f'request_{request_type.lower()}'] = values[clarification_measure(request_type)]
+        return measures
+
 
 class ClarificationRequestsByStandardStats(ClarificationRequestStatsMixin, ApplicationStatsMixin, StatsView):
     """
@@ -601,14 +814,11 @@ class ClarificationRequestsByStandardStats(ClarificationRequestStatsMixin, Appli
     date_filter_default = 'decisionDate'
     field_labels = { 'standard': 'ESG', **ClarificationRequestStatsMixin.field_labels }
 
-    x_range = EsgStandard.objects.filter(version__active=True)
+    x_range = ESG_STANDARDS
 
     def filter_queryset_by_x(self, esg, **kwargs):
         return self.get_queryset()
 
-    def x_to_str(self, esg):
-        return esg.short_name
-
     def stats(self, filtered_qs, esg, **kwargs):
         filter_kwargs = { f'applicationclarification__esg_{esg.attribute_name}': True }
         return super().stats(filtered_qs, esg, **filter_kwargs)
@@ -622,19 +832,24 @@ class ComplianceTimelineByStandard(ApplicationStatsMixin, ApplicationByYearMixin
     """
     field_labels = (
             'year',
-            'Compliance',
-            'Partial compliance',
-            'Non-compliance',
+            *COMPLIANCE_LEVELS,
         )
 
-    def stats(self, filtered_qs, year, esg, **kwargs):
-        this = { }
-        for count in filtered_qs.exclude(**{f'{esg.rc}__isnull': True}).values(esg.rc).annotate(n=Count('id')).order_by(esg.rc):
-            this[count[esg.rc]] = count['n']
-        return this
+    def get_grouped_queryset(self, esg, **kwargs):
+        return super().get_grouped_queryset()
+
+    def get_measures(self, esg, **kwargs):
+        return { compliance: Count('id', filter=Q(**{esg.rc: compliance})) for compliance in COMPLIANCE_LEVELS }
+
+    def rollup_to_measures(self, values, esg, **kwargs):
+        return { compliance: values[rc_measure(esg.rc, compliance)] for compliance in COMPLIANCE_LEVELS }
+
+    def finalize_stats(self, values, year, **kwargs):
+        # only compliance levels that occurred
+        return { compliance: n for compliance, n in values.items() if n }
 
     def get_stats(self, **kwargs):
-        stats = { }
+        sheets = { }
         for esg in EsgList():
-            stats[str(esg)] = self.iterate_over_x(esg=esg, **kwargs)
-        return stats
+            sheets[str(esg)] = partial(self.iterate_over_x, esg=esg, **kwargs)
+        return self.evaluate_sheets(sheets)
@@ -1,5 +1,19 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_save, post_delete, m2m_changed
 
 
 class UniDbConfig(AppConfig):
     name = 'uni_db'
+
+    def ready(self):
+        from uni_db.query_cache import invalidate_table, invalidate_m2m_table
+        post_save.connect(invalidate_table, dispatch_uid='uni_db-query-cache-save')
+        post_delete.connect(invalidate_table, dispatch_uid='uni_db-query-cache-delete')
+        m2m_changed.connect(invalidate_m2m_table, dispatch_uid='uni_db-query-cache-m2m')
+        from uni_db.search import register_views, update_search_index
+        from uni_db.views_meta import UniDB
+        register_views(UniDB.Tables)
+        from uni_db.labels import connect_signals
+        connect_signals([ view.queryset.model for view in UniDB.Tables ])
+        post_save.connect(update_search_index, dispatch_uid='uni_db-search-save')
+        post_delete.connect(update_search_index, dispatch_uid='uni_db-search-delete')
@@ -1,13 +1,24 @@
-from django.db.models import Count
+import base64
+import datetime
+import json
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, F, Q, Value, IntegerField
+from django.db.models.constants import LOOKUP_SEP
 from django.forms.models import ModelChoiceIteratorValue
 
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
-from django_filters import ChoiceFilter, NumberFilter
+from django_filters import ChoiceFilter, ModelChoiceFilter, NumberFilter
 from django_filters.rest_framework import DjangoFilterBackend, FilterSet
 from django_filters.rest_framework.filters import BooleanFilter
 
 from uni_db.fields import EnumField
+from uni_db.labels import get_labels, get_ordering
 
 class FilterBackend(DjangoFilterBackend):
     """
@@ -44,42 +55,399 @@ class FilterBackend(DjangoFilterBackend):
         return(filterset)
 
 
+_choice_labels = { }
+
+def get_choice_labels(filter):
+    """
+    labels of a ChoiceFilter with static choices (e.g. EnumField), computed once per field
+    """
+    key = (filter.model, filter.field_name)
+    if key not in _choice_labels:
+        _choice_labels[key] = { ( value.value if isinstance(value, ModelChoiceIteratorValue) else value ): label for value, label in filter.field.choices }
+    return _choice_labels[key]
+
+
+def _resolve_field(model, path):
+    """
+    returns the field at the end of a lookup path such as agency__organisation__longname
+    """
+    parts = path.split('__')
+    for part in parts[:-1]:
+        model = model._meta.get_field(part).related_model
+        if model is None:
+            raise FieldDoesNotExist(path)
+    if parts[-1] == 'pk':
+        return model._meta.pk
+    return model._meta.get_field(parts[-1])
+
+def _spans_many(model, path):
+    """
+    whether a lookup path goes through a to-many relation, i.e. may join several rows per record
+    """
+    for part in path.split(LOOKUP_SEP):
+        try:
+            field = model._meta.get_field(part)
+        except FieldDoesNotExist:
+            return False
+        if not field.is_relation:
+            return False
+        if field.many_to_many or field.one_to_many:
+            return True
+        model = field.related_model
+    return False
+
+def _expand_ordering(model, ordering, prefix='', seen=None):
+    """
+    expands an ordering into ( path, descending ) tuples of concrete columns
+
+    Ordering by a relation is replaced by the related model's default ordering,
+    the same way the ORM does it, so that every term has a value we can compare to.
+    Expressions and annotations cannot be compared to a cursor value and raise
+    ValidationError, as they would leave the key without a defined order.
+    """
+    seen = seen or set()
+    terms = [ ]
+    for item in ordering:
+        if item == '?':
+            continue
+        if not isinstance(item, str):
+            raise ValidationError(f'Ordering by {item} is not supported with cursor pagination')
+        descending = item.startswith('-')
+        path = prefix + item.lstrip('-')
+        try:
+            field = _resolve_field(model, item.lstrip('-'))
+        except FieldDoesNotExist:
+            raise ValidationError(f'Ordering by {item} is not supported with cursor pagination')
+        if field.is_relation:
+            related = field.related_model
+            if related in seen:
+                continue
+            for sub_path, sub_descending in _expand_ordering(related, related._meta.ordering or [ 'pk' ], path + '__', seen | { related }):
+                terms.append(( sub_path, sub_descending != descending ))
+        else:
+            terms.append(( path, descending ))
+    return terms
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """
+    JSON encoder for cursor values: unlike DjangoJSONEncoder, times keep their microseconds
+    """
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPagination(pagination.BasePagination):
+    """
+    keyset (cursor) pagination that follows the ordering of the queryset
+
+    Rather than skipping OFFSET rows, each page is selected by a WHERE condition on the
+    ordering columns of the last (or first) row of the previous page, with the primary key
+    added as tiebreaker. The opaque cursor encodes these values; the total count is only
+    computed if requested by ?count=true.
+
+    NULL values are treated as the lowest values, which is how MySQL/MariaDB sort them.
+    """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    limit_query_param = 'limit'
+    default_limit = pagination.LimitOffsetPagination.default_limit
+    max_limit = None
+
+    def get_ordering(self, queryset):
+        ordering = _expand_ordering(queryset.model, queryset.query.order_by or queryset.model._meta.ordering)
+        pk = queryset.model._meta.pk.name
+        if ( pk, False ) not in ordering and ( pk, True ) not in ordering:
+            ordering.append(( pk, False ))
+        return ordering
+
+    def encode_cursor(self, values, reverse):
+        data = json.dumps({ 'v': values, 'r': reverse }, cls=CursorEncoder)
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return ( None, False )
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            values = data['v']
+            reverse = bool(data['r'])
+        except (TypeError, ValueError, KeyError, UnicodeDecodeError):
+            raise NotFound('Invalid cursor')
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound('Invalid cursor')
+        return ( values, reverse )
+
+    def get_position_filter(self, ordering, values):
+        """
+        condition selecting all rows after the given values in the given ordering:
+        (a > x) OR (a = x AND b > y) OR ...
+        """
+        condition = Q(pk__in=[ ])
+        equal = Q()
+        for ( path, descending ), value in zip(ordering, values):
+            if value is None:
+                # NULL is the lowest value: in descending order, nothing comes after it
+                if not descending:
+                    condition |= equal & Q(**{ f'{path}__isnull': False })
+                equal &= Q(**{ f'{path}__isnull': True })
+            else:
+                if descending:
+                    after = Q(**{ f'{path}__lt': value }) | Q(**{ f'{path}__isnull': True })
+                else:
+                    after = Q(**{ f'{path}__gt': value })
+                condition |= equal & after
+                equal &= Q(**{ path: value })
+        return condition
+
+    def order_queryset(self, queryset, ordering):
+        """
+        applies the ordering and adds the values of its columns as _cursor0, _cursor1, ...
+        """
+        queryset = queryset.order_by(*[ f'-{path}' if descending else path for path, descending in ordering ])
+        return queryset.annotate(**{ f'_cursor{i}': F(path) for i, ( path, descending ) in enumerate(ordering) })
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = pagination.LimitOffsetPagination.get_limit(self, request)
+        self.ordering = self.get_ordering(queryset)
+        values, self.reverse = self.decode_cursor(request)
+
+        self.count = queryset.count() if request.query_params.get(self.count_query_param) == 'true' else None
+
+        ordering = [ ( path, descending != self.reverse ) for path, descending in self.ordering ]
+        queryset = self.order_queryset(queryset, ordering)
+        if values is not None:
+            queryset = queryset.filter(self.get_position_filter(ordering, values))
+
+        page = list(queryset[:self.limit + 1])
+        has_more = len(page) > self.limit
+        page = page[:self.limit]
+        if self.reverse:
+            page.reverse()
+            self.has_next = values is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = values is not None
+        self.page = page
+        return(page)
+
+    def get_cursor_values(self, obj):
+        return [ getattr(obj, f'_cursor{i}') for i in range(len(self.ordering)) ]
+
+    def get_link(self, obj, reverse):
+        url = remove_query_param(self.request.build_absolute_uri(), 'offset')
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.get_cursor_values(obj), reverse))
+
+    def get_next_link(self):
+        if not (self.has_next and self.page):
+            return None
+        return self.get_link(self.page[-1], False)
+
+    def get_previous_link(self):
+        if not (self.has_previous and self.page):
+            return None
+        return self.get_link(self.page[0], True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
+def keyset_iterator(queryset, chunk_size=1000):
+    """
+    iterates over all records of queryset, in its ordering, fetching one chunk at a time
+
+    Chunks are selected by keyset conditions (see KeysetPagination), so neither the
+    database client nor we hold more than one chunk in memory, and prefetch_related
+    lookups are applied per chunk. Orderings that cannot be used as keyset (e.g. by an
+    annotation) fall back to chunks selected by OFFSET.
+    """
+    keyset = KeysetPagination()
+    try:
+        ordering = keyset.get_ordering(queryset)
+    except ValidationError:
+        offset = 0
+        chunk = list(queryset[:chunk_size])
+        while chunk:
+            yield from chunk
+            if len(chunk) < chunk_size:
+                break
+            offset += chunk_size
+            chunk = list(queryset[offset:offset + chunk_size])
+        return
+    queryset = keyset.order_queryset(queryset, ordering)
+    chunk = list(queryset[:chunk_size])
+    while chunk:
+        yield from chunk
+        if len(chunk) < chunk_size:
+            break
+        values = [ getattr(chunk[-1], f'_cursor{i}') for i in range(len(ordering)) ]
+        chunk = list(queryset.filter(keyset.get_position_filter(ordering, values))[:chunk_size])
+
+
 class SearchFacetPagination(pagination.LimitOffsetPagination):
     """
     custom pagination class that adds options and record counts for searchable fields
+
+    Facets can be restricted by ?facets=field1,field2 or skipped by ?facets=none
+
+    With ?cursor= (empty for the first page) keyset pagination is used instead of
+    limit/offset, see KeysetPagination.
     """
+    facets_query_param = 'facets'
+    keyset_pagination_class = KeysetPagination
 
     def paginate_queryset(self, queryset, request, view=None):
         """
-        no custom behaviour here, but we need QuerySet and View objects later on
-        (they're not passed to the function we actually customise)
+        we need QuerySet and View objects later on (they're not passed to the function
+        we actually customise); switch to keyset pagination if a cursor is passed
         """
         self.qs = queryset
         self.view = view
         self.request = request
+        if self.keyset_pagination_class.cursor_query_param in request.query_params:
+            self.keyset = self.keyset_pagination_class()
+            return(self.keyset.paginate_queryset(queryset, request, view))
+        self.keyset = None
         return(super().paginate_queryset(queryset, request, view))
 
-    def get_paginated_response(self, data):
-        r = super().get_paginated_response(data) # data as original class returns it
+    def get_facet_filters(self):
+        """
+        filters for which facets are generated
+        """
+        if not (hasattr(self.request, 'filterset') and hasattr(self.request.filterset, 'filters')):
+            return { }
+        filters = self.request.filterset.filters
+        requested = self.request.query_params.get(self.facets_query_param)
+        if requested is None:
+            return filters
+        elif requested == 'none':
+            return { }
+        else:
+            requested = requested.split(',')
+            return { field: filter for field, filter in filters.items() if field in requested }
+
+    def get_boolean_facets(self, filters):
+        """
+        counts for True/False of all boolean filters, using one conditional-aggregate query
+
+        Filters across to-many relations are counted with separate queries: in the aggregate
+        their joins would multiply the rows counted for every other facet.
+        """
+        aggregates = { }
         facets = { }
-        if hasattr(self.request, 'filterset') and hasattr(self.request.filterset, 'get_filters'):
-            for field, filter in self.request.filterset.get_filters().items():
-                if isinstance(filter, (ChoiceFilter, NumberFilter)):
-                    facet = [ ]
-                    if isinstance(filter, ChoiceFilter):
-                        labels = { ( value.value if isinstance(value, ModelChoiceIteratorValue) else value ): label for value, label in filter.field.choices }
-                    for choice in self.qs.values(field).annotate(_count=Count(field)).order_by(field):
-                        if choice['_count'] > 0:
-                            if isinstance(filter, ChoiceFilter) and choice[field] in labels:
-                                facet.append((choice[field], choice['_count'], labels[choice[field]]))
-                            else:
-                                facet.append((choice[field], choice['_count']))
-                    facets[field] = facet
-                elif isinstance(filter, BooleanFilter):
+        for i, (field, filter) in enumerate(filters.items()):
+            if filter.method is not None or _spans_many(self.qs.model, filter.field_name):
+                # custom filter methods cannot be expressed as aggregate
+                facets[field] = [
+                    ( True, filter.filter(self.qs, True).count() ),
+                    ( False, filter.filter(self.qs, False).count() ),
+                ]
+                continue
+            for value in (True, False):
+                q = Q(**{ f'{filter.field_name}__{filter.lookup_expr}': value })
+                aggregates[f'facet{i}_{value}'] = Count('pk', filter=~q if filter.exclude else q)
+        if aggregates:
+            counts = self.qs.aggregate(**aggregates)
+            for i, field in enumerate(filters):
+                if field not in facets:
                     facets[field] = [
-                        ( True, filter.filter(self.qs, True).count() ),
-                        ( False, filter.filter(self.qs, False).count() ),
+                        ( True, counts[f'facet{i}_True'] ),
+                        ( False, counts[f'facet{i}_False'] ),
                     ]
-        r.data['facets'] = facets   # augment by search facets
-        return(r)
+        return facets
+
+    def get_output_field(self, expression):
+        return self.qs.annotate(_facet_value=expression).query.annotations['_facet_value'].output_field
+
+    def get_facet_expression(self, filter):
+        """
+        expression for the values a filter is applied to: its field, with the transforms
+        its lookup starts with (e.g. the year of a date for a __year filter)
+        """
+        expression = F(filter.field_name)
+        for name in filter.lookup_expr.split(LOOKUP_SEP):
+            transform = self.get_output_field(expression).get_transform(name)
+            if transform is None:
+                break
+            expression = transform(expression)
+        return expression
 
+    def get_grouped_facets(self, filters):
+        """
+        value counts of all choice and number filters
+
+        Each facet is a GROUP BY query; they are combined into one UNION ALL query, in
+        which each facet has its own value column (NULL in the other facets' rows).
+        """
+        fields = list(filters)
+        expressions = [ self.get_facet_expression(filters[field]) for field in fields ]
+        output_fields = [ self.get_output_field(expression) for expression in expressions ]
+        queries = [ ]
+        for i, field in enumerate(fields):
+            values = { '_facet': Value(i, output_field=IntegerField()) }
+            for j, expression in enumerate(expressions):
+                if j == i:
+                    values[f'_value{j}'] = expression
+                else:
+                    values[f'_value{j}'] = Value(None, output_field=output_fields[j])
+            queries.append(self.qs.order_by().annotate(**values).values(*values).annotate(_count=Count(f'_value{i}')))
+        if len(queries) > 1:
+            rows = queries[0].union(*queries[1:], all=True)
+        elif queries:
+            rows = queries[0]
+        else:
+            rows = [ ]
+        counts = { field: [ ] for field in fields }
+        for row in rows:
+            if row['_count'] > 0:
+                counts[fields[row['_facet']]].append((row[f'_value{row["_facet"]}'], row['_count']))
+
+        facets = { }
+        for field, filter in filters.items():
+            facet = [ ]
+            if isinstance(filter, ChoiceFilter):
+                if isinstance(filter, ModelChoiceFilter):
+                    # labels only for values that occur, from the label cache
+                    model = filter.field.queryset.model
+                    to_field = filter.field.to_field_name or 'pk'
+                    labels = get_labels(model, [ value for value, count in counts[field] ], to_field)
+                    order = get_ordering(model, to_field)
+                else:
+                    labels = get_choice_labels(filter)
+                    # same order as the choices, i.e. as ORDER BY on the field would return them
+                    order = { value: position for position, value in enumerate(labels) }
+                for value, count in sorted(counts[field], key=lambda choice: (order.get(choice[0], len(order)), choice[0])):
+                    if value in labels:
+                        facet.append((value, count, labels[value]))
+                    else:
+                        facet.append((value, count))
+            else:
+                facet = sorted(counts[field])
+            facets[field] = facet
+        return facets
+
+    def get_facets(self):
+        filters = self.get_facet_filters()
+        grouped = self.get_grouped_facets({ field: filter for field, filter in filters.items() if isinstance(filter, (ChoiceFilter, NumberFilter)) })
+        boolean = self.get_boolean_facets({ field: filter for field, filter in filters.items() if isinstance(filter, BooleanFilter) })
+        # keep order of filters
+        return { field: grouped.get(field, boolean.get(field)) for field in filters if field in grouped or field in boolean }
+
+    def get_paginated_response(self, data):
+        if self.keyset:
+            r = self.keyset.get_paginated_response(data)
+        else:
+            r = super().get_paginated_response(data) # data as original class returns it
+        r.data['facets'] = self.get_facets()   # augment by search facets
+        return(r)
@@ -0,0 +1,23 @@
+"""
+generation tokens for cache invalidation
+
+Cached entries that depend on some data include a generation token in their keys. The
+token is renewed whenever the data changes, so that outdated entries are no longer used.
+Tokens are kept in a cache of their own (GENERATIONS_CACHE), which is never culled along
+with the entries they invalidate.
+"""
+
+import uuid
+
+from django.core.cache import caches
+
+GENERATIONS_CACHE = 'generations'
+
+def get_generation(key):
+    """
+    current token stored under key, set to a new one if there is none
+    """
+    return caches[GENERATIONS_CACHE].get_or_set(key, uuid.uuid4().hex, None)
+
+def renew_generation(key):
+    caches[GENERATIONS_CACHE].set(key, uuid.uuid4().hex, None)
@@ -0,0 +1,204 @@
+"""
+cache of record labels - i.e. str() of model instances - for facets and choice lists
+
+Each model has a generation token in the shared cache; it is renewed whenever an
+instance of the model, or of a model its __str__ depends on (through str_related), is
+saved or deleted.
+
+Labels are kept in memory by each process, in one map per model and field they are
+looked up by (primary key or another unique field), which is dropped when the model's
+generation changes. Keeping them in the shared cache would need one entry per label.
+
+Choice lists - all instances of a model, optionally filtered by limit_choices_to - and
+orderings are stored in the shared cache under keys including the generation, depending
+also on the models the filter refers to.
+
+The relations a model's __str__ uses are declared as str_related on the model, so
+they can be fetched along with the records.
+"""
+
+import hashlib
+
+from functools import lru_cache
+
+from django.apps import apps
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q, QuerySet
+from django.db.models.signals import post_save, post_delete
+
+from uni_db import generations
+
+_labels = { }
+
+def _namespace(model, field):
+    return f'labels:{model._meta.label_lower}:{field}'
+
+def _generation_key(model):
+    return f'labels:{model._meta.label_lower}:generation'
+
+def get_generation(model):
+    return generations.get_generation(_generation_key(model))
+
+def get_related_lookups(model, fields):
+    """
+    returns ( select_related, prefetch_related ) lookups needed to render fields and
+    __str__ of model without further queries
+
+    Relations rendered as strings are followed into the __str__ dependencies of the
+    related model, which models declare as str_related = [ field, ... ].
+    """
+    select_related = [ ]
+    prefetch_related = [ ]
+
+    def add_relation(model, name, prefix, many):
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return
+        if not field.is_relation:
+            return
+        lookup = prefix + name
+        many = many or field.many_to_many or field.one_to_many
+        lookups = prefetch_related if many else select_related
+        if lookup not in lookups:
+            lookups.append(lookup)
+        add_str_related(field.related_model, lookup + '__', many)
+
+    def add_str_related(model, prefix, many):
+        for name in getattr(model, 'str_related', [ ]):
+            add_relation(model, name, prefix, many)
+
+    for name in fields:
+        add_relation(model, name, '', False)
+    add_str_related(model, '', False)
+    return(select_related, prefetch_related)
+
+@lru_cache(maxsize=None)
+def get_str_lookups(model):
+    return get_related_lookups(model, [ ])
+
+def get_label_models(model, fields):
+    """
+    model and all models whose labels are rendered along with fields and __str__ of model,
+    i.e. those whose generations change with what is rendered
+    """
+    models = [ model ]
+    select_related, prefetch_related = get_related_lookups(model, fields)
+    for lookup in select_related + prefetch_related:
+        this = model
+        for name in lookup.split('__'):
+            this = this._meta.get_field(name).related_model
+        if this not in models:
+            models.append(this)
+    return models
+
+def get_labels(model, values, field='pk'):
+    """
+    returns dict( [value]: [label], ... ) for instances of model with field in values
+
+    only labels that are not known yet in this process are fetched from the database
+    """
+    generation = get_generation(model)
+    state = _labels.get((model, field))
+    if state is None or state[0] != generation:
+        state = _labels[(model, field)] = ( generation, { } )
+    known = state[1]
+    missing = [ value for value in values if value not in known ]
+    if missing:
+        select_related, prefetch_related = get_str_lookups(model)
+        queryset = model._default_manager.filter(**{ f'{field}__in': missing }).select_related(*select_related).prefetch_related(*prefetch_related)
+        known.update({ getattr(obj, field): str(obj) for obj in queryset })
+    return { value: known[value] for value in values if value in known }
+
+def get_ordering(model, field='pk'):
+    """
+    returns dict( [value]: [position], ... ) for all instances of model in its default ordering
+    """
+    key = f'{_namespace(model, field)}:{get_generation(model)}:ordering'
+    ordering = cache.get(key)
+    if ordering is None:
+        ordering = { value: position for position, value in enumerate(model._default_manager.values_list(field, flat=True)) }
+        cache.set(key, ordering)
+    return ordering
+
+@lru_cache(maxsize=None)
+def get_dependent_models(model):
+    """
+    model itself and all models whose __str__ includes it, i.e. that refer to it through
+    str_related, directly or through other models' str_related
+    """
+    dependent = [ model ]
+    for this in dependent:
+        for other in apps.get_models():
+            for name in getattr(other, 'str_related', [ ]):
+                try:
+                    field = other._meta.get_field(name)
+                except FieldDoesNotExist:
+                    continue
+                if field.is_relation and field.related_model is this and other not in dependent:
+                    dependent.append(other)
+    return dependent
+
+def invalidate_labels(sender, **kwargs):
+    for model in get_dependent_models(sender):
+        generations.renew_generation(_generation_key(model))
+
+def connect_signals(models):
+    """
+    invalidate labels on changes to models, and to all models whose labels they render
+    (through relations in either direction)
+    """
+    connected = [ ]
+    for model in models:
+        for this in get_label_models(model, [ field.name for field in model._meta.get_fields() ]):
+            if this not in connected:
+                connected.append(this)
+                post_save.connect(invalidate_labels, sender=this, dispatch_uid=f'uni_db-labels-{this._meta.label_lower}-save')
+                post_delete.connect(invalidate_labels, sender=this, dispatch_uid=f'uni_db-labels-{this._meta.label_lower}-delete')
+
+def _describe_filter(model, q, models):
+    """
+    returns a stable description of the Q object q, and adds the models it refers to to models
+    """
+    children = [ ]
+    for child in q.children:
+        if isinstance(child, Q):
+            children.append(_describe_filter(model, child, models))
+            continue
+        lookup, value = child
+        this = model
+        for part in lookup.split('__'):
+            try:
+                field = this._meta.get_field(part)
+            except FieldDoesNotExist:
+                break
+            if not field.is_relation:
+                break
+            this = field.related_model
+            models.add(this)
+        if isinstance(value, QuerySet):
+            models.add(value.model)
+            value = str(value.query)
+        children.append(f'{lookup}={value!r}')
+    return f'{"NOT " if q.negated else ""}{q.connector}({", ".join(children)})'
+
+def get_choices(model, field='pk', limit_choices_to=None):
+    """
+    returns list( ( [value], [label] ), ... ) of all instances of model in its default
+    ordering, filtered by limit_choices_to (a Q object) if given
+    """
+    models = { model }
+    description = _describe_filter(model, limit_choices_to, models) if limit_choices_to else ''
+    tokens = ':'.join(get_generation(m) for m in sorted(models, key=lambda m: m._meta.label_lower))
+    key = f'{_namespace(model, field)}:choices:{hashlib.md5(f"{tokens}:{description}".encode()).hexdigest()}'
+    choices = cache.get(key)
+    if choices is None:
+        select_related, prefetch_related = get_str_lookups(model)
+        queryset = model._default_manager.select_related(*select_related).prefetch_related(*prefetch_related)
+        if limit_choices_to:
+            queryset = queryset.filter(limit_choices_to)
+        # filters across relations may return an instance more than once
+        choices = list({ getattr(obj, field): str(obj) for obj in queryset }.items())
+        cache.set(key, choices)
+    return choices
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from uni_db.models import SearchIndex
+from uni_db.search import get_indexed_models, update_index
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help = 'number of records indexed at once')
+
+    def handle(self, *args, **options):
+        # entries are replaced in place, and each model in one transaction, so that searches
+        # never see a partial index
+        for model in get_indexed_models():
+            with transaction.atomic():
+                pks = list(model._default_manager.values_list('pk', flat=True))
+                for start in range(0, len(pks), options['chunk_size']):
+                    update_index(model, pks[start:start + options['chunk_size']])
+                removed = set(SearchIndex.objects.filter(model=model._meta.label_lower).values_list('object_id', flat=True)) - { str(pk) for pk in pks }
+                SearchIndex.objects.filter(model=model._meta.label_lower, object_id__in=removed).delete()
+            self.stdout.write(f'{model._meta.label}: {len(pks)} records indexed')
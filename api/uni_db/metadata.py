@@ -1,14 +1,19 @@
 from collections import OrderedDict
 from rest_framework.metadata import SimpleMetadata
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 from django.db import models
+from django.urls import NoReverseMatch
+
+from uni_db.labels import get_choices
 
 class ExtendedMetadata(SimpleMetadata):
 
     """
     Metadata class that returns additional information:
 
-    - list of possible choices for foreign key fields
+    - list of possible choices for foreign key fields (cached, see uni_db.labels), or
+      with ?choices=lazy a choices_url for type-ahead search, where possible
     - field order
     - decimal number length
     - distinguish between CharField and TextField
@@ -30,6 +35,22 @@ class ExtendedMetadata(SimpleMetadata):
         metadata['field_order'] = view.get_field_order()
         return(metadata)
 
+    def get_choices_url(self, field, field_info):
+        """
+        URL of the select action of the foreign table, if choices are requested lazily
+
+        Only possible if the select action returns the foreign key values, i.e. for keys
+        referring to the primary key, and if choices are not restricted by limit_choices_to.
+        """
+        if self.request.query_params.get('choices') != 'lazy':
+            return None
+        if getattr(field, 'limit_choices_to', None) or field_info['foreign_key'] != field.queryset.model._meta.pk.name:
+            return None
+        try:
+            return reverse(f"{field_info['foreign_table']}-select", request=self.request)
+        except NoReverseMatch:
+            return None
+
     def get_field_info(self, field):
         field_info = super().get_field_info(field)
         model_field = getattr(getattr(field.parent.Meta.model, field.source, None), 'field', None)
@@ -44,12 +65,13 @@ class ExtendedMetadata(SimpleMetadata):
                     foreign_instance = getattr(self.instance, field.field_name)
                     if foreign_instance:
                         choices[getattr(foreign_instance, field_info['foreign_key'])] = str(foreign_instance)
-                if getattr(field, 'limit_choices_to', None):
-                    queryset = field.queryset.filter(field.limit_choices_to)
+                choices_url = self.get_choices_url(field, field_info)
+                if choices_url:
+                    field_info['choices_url'] = choices_url
                 else:
-                    queryset = field.queryset.all()
-                for choice in queryset.iterator():
-                    choices[getattr(choice, field_info['foreign_key'])] = str(choice)
+                    limit_choices_to = getattr(field, 'limit_choices_to', None)
+                    for choice_value, choice_name in get_choices(field.queryset.model, field_info['foreign_key'], limit_choices_to):
+                        choices[choice_value] = choice_name
                 field_info['choices'] = [
                     {
                         'value': choice_value,
@@ -0,0 +1,28 @@
+# Generated by Django 3.1.2 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uni_db', '0002_convert_legacy_queries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rawquery',
+            name='max_statement_time',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Maximum execution time (seconds)'),
+        ),
+        migrations.AddField(
+            model_name='rawquery',
+            name='estimated_rows',
+            field=models.BigIntegerField(editable=False, null=True, verbose_name='Estimated rows'),
+        ),
+        migrations.AddField(
+            model_name='rawquery',
+            name='estimated_cost',
+            field=models.FloatField(editable=False, null=True, verbose_name='Estimated cost'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.1.2 on 2026-10-18 14:00
+
+from django.db import migrations, models
+
+
+def create_fulltext_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        # index stopwords as well, search terms are names and keywords
+        schema_editor.execute("SET SESSION innodb_ft_enable_stopword = OFF")
+        schema_editor.execute("CREATE FULLTEXT INDEX `_search_index_text` ON `_search_index` (`text`)")
+
+def drop_fulltext_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute("DROP INDEX `_search_index_text` ON `_search_index`")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uni_db', '0003_rawquery_query_plan'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchIndex',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100, verbose_name='Model')),
+                ('object_id', models.CharField(max_length=255, verbose_name='Object ID')),
+                ('text', models.TextField(verbose_name='Text')),
+            ],
+            options={
+                'verbose_name': 'Search index entry',
+                'verbose_name_plural': 'Search index',
+                'db_table': '_search_index',
+                'unique_together': {('model', 'object_id')},
+            },
+        ),
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+    ]
@@ -1,3 +1,5 @@
+from django.http import StreamingHttpResponse
+
 class ReadWriteSerializerMixin(object):
     """
     Overrides get_serializer_class to choose:
@@ -58,3 +60,23 @@ class ReadWriteSerializerMixin(object):
         )
         return self.write_serializer_class
 
+
+
+class StreamingDownloadMixin(object):
+    """
+    Sends downloads as streaming response if the renderer supports it (CSV, JSON Lines),
+    so rows are written as they are fetched rather than building the whole output first.
+    """
+
+    stream_chunk_size = 1000
+
+    def is_streaming(self):
+        return hasattr(self.request.accepted_renderer, 'render_stream')
+
+    def get_streaming_response(self, rows):
+        renderer = self.request.accepted_renderer
+        context = self.get_renderer_context()
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type = f'{content_type}; charset={renderer.charset}'
+        return StreamingHttpResponse(renderer.render_stream(rows, context), content_type=content_type)
@@ -15,6 +15,9 @@ class RawQuery(models.Model):
     is_shared = models.BooleanField("Shared", default=False)
     underlying_table = models.CharField("Underlying table", max_length=255, blank=True, null=True)
     owner = models.ForeignKey(auth.models.User, on_delete=models.RESTRICT, verbose_name="Owned by")
+    max_statement_time = models.PositiveIntegerField("Maximum execution time (seconds)", blank=True, null=True)
+    estimated_rows = models.BigIntegerField("Estimated rows", editable=False, null=True)
+    estimated_cost = models.FloatField("Estimated cost", editable=False, null=True)
 
     def __str__(self):
         return(self.description)
@@ -25,3 +28,20 @@ class RawQuery(models.Model):
         verbose_name_plural = "Raw queries"
         ordering = [ 'description' ]
 
+
+class SearchIndex(models.Model):
+    """
+    text of the search fields of a record, for full-text search (see uni_db.search)
+    """
+    model = models.CharField("Model", max_length=100)
+    object_id = models.CharField("Object ID", max_length=255)
+    text = models.TextField("Text")
+
+    def __str__(self):
+        return(f'{self.model}:{self.object_id}')
+
+    class Meta:
+        db_table = '_search_index'
+        verbose_name = "Search index entry"
+        verbose_name_plural = "Search index"
+        unique_together = [ ( 'model', 'object_id' ) ]
@@ -0,0 +1,184 @@
+"""
+cache of raw query results, invalidated per table
+
+Each database table has a generation token that is renewed whenever an instance of the
+model stored in it is saved or deleted, or a many-to-many relation stored in it is changed.
+Results of a raw query are cached under a key including the generations of all tables its
+SQL refers to. Queries referring to tables that are not managed by a model (and thus cannot
+be tracked), or whose FROM and JOIN clauses cannot be parsed, are not cached.
+
+QuerySet.update(), bulk_create() and bulk_update() send no signals: code using them must
+call invalidate_model() afterwards. Changes made outside of Django (e.g. by SQL scripts)
+are only picked up when results expire after RAW_QUERY_RESULT_CACHE_TIMEOUT.
+"""
+
+import hashlib
+import re
+
+from functools import lru_cache
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+
+from uni_db import generations
+
+def _generation_key(table):
+    return f'rawquery:table:{table.lower()}:generation'
+
+def get_table_generation(table):
+    return generations.get_generation(_generation_key(table))
+
+def invalidate_model(model):
+    generations.renew_generation(_generation_key(model._meta.db_table))
+
+def invalidate_table(sender, **kwargs):
+    invalidate_model(sender)
+
+def invalidate_m2m_table(sender, action, **kwargs):
+    # sender is the through model, i.e. the table the relation is stored in
+    if action in [ 'post_add', 'post_remove', 'post_clear' ]:
+        invalidate_model(sender)
+
+def get_model_tables():
+    return { model._meta.db_table.lower() for model in apps.get_models() }
+
+_sql_token = re.compile(r"""
+    (?P<skip>\s+|--[^\n]*|\#[^\n]*|/\*.*?\*/|'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*")
+  | (?P<name>`[^`]*`|\w+)(?:\s*\.\s*(?P<qualified>`[^`]*`|\w+))?
+  | (?P<symbol>.)
+""", re.VERBOSE | re.DOTALL)
+
+# keywords that may follow a table reference, i.e. are not an alias
+_clause_keywords = {
+    'where', 'join', 'inner', 'outer', 'left', 'right', 'cross', 'natural', 'straight_join', 'on', 'using',
+    'group', 'order', 'having', 'limit', 'union', 'window', 'for', 'lock', 'into', 'procedure',
+    'use', 'ignore', 'force', 'partition', 'except', 'intersect',
+}
+
+def _tokenize(sql):
+    """
+    splits sql into ( kind, value ) tokens, dropping whitespace, comments and string literals
+    """
+    tokens = [ ]
+    for match in _sql_token.finditer(sql):
+        if match.group('name'):
+            kind = 'qualified' if match.group('qualified') else 'name'
+            tokens.append(( kind, match.group('name').strip('`').lower() ))
+        elif match.group('symbol'):
+            tokens.append(( 'symbol', match.group('symbol') ))
+    return(tokens)
+
+def _matching_paren(tokens, i):
+    depth = 0
+    for j in range(i, len(tokens)):
+        if tokens[j] == ( 'symbol', '(' ):
+            depth += 1
+        elif tokens[j] == ( 'symbol', ')' ):
+            depth -= 1
+            if depth == 0:
+                return(j)
+    raise ValueError('unbalanced parentheses')
+
+# keywords that end a FROM clause
+_from_end_keywords = { 'where', 'group', 'having', 'order', 'limit', 'union', 'window', 'into', 'for', 'lock', 'procedure', 'except', 'intersect' }
+
+def _parse_tables(tokens, names, function=False):
+    """
+    adds the tables of all FROM and JOIN clauses in tokens to names, recursing into parentheses
+
+    Within a FROM clause, every comma outside parentheses is followed by another table reference.
+    """
+    in_from = False
+    i = 0
+    while i < len(tokens):
+        kind, value = tokens[i]
+        if ( kind, value ) == ( 'symbol', '(' ):
+            end = _matching_paren(tokens, i)
+            inner = tokens[i+1:end]
+            _parse_tables(inner, names, inner[:1] not in ( [ ( 'name', 'select' ) ], [ ( 'symbol', '(' ) ] ))
+            i = end + 1
+        elif ( kind, value ) == ( 'symbol', ')' ):
+            raise ValueError('unbalanced parentheses')
+        elif function:
+            i += 1
+        elif ( kind, value ) in ( ( 'name', 'from' ), ( 'name', 'join' ) ) or (in_from and ( kind, value ) == ( 'symbol', ',' )):
+            in_from = True
+            i = _parse_table_reference(tokens, i + 1, names)
+        else:
+            if kind == 'name' and value in _from_end_keywords | { 'select' }:
+                in_from = False
+            i += 1
+
+def _parse_table_reference(tokens, i, names):
+    """
+    parses one table reference (with alias) starting at tokens[i], returns the index after it
+    """
+    if i >= len(tokens):
+        raise ValueError('missing table reference')
+    if tokens[i] == ( 'symbol', '(' ):
+        end = _matching_paren(tokens, i)
+        _parse_tables(tokens[i+1:end], names)
+        i = end + 1
+    elif tokens[i][0] == 'name':
+        names.add(tokens[i][1])
+        i += 1
+    else:
+        raise ValueError(f'cannot parse table reference {tokens[i][1]}')
+    if i < len(tokens) and tokens[i] == ( 'name', 'as' ):
+        i += 1
+    if i < len(tokens) and tokens[i][0] == 'name' and tokens[i][1] not in _clause_keywords:
+        i += 1
+    return(i)
+
+def parse_table_references(sql):
+    """
+    returns the names of all tables in FROM and JOIN clauses of sql, including comma-separated
+    lists; raises ValueError if a table reference cannot be parsed (or is qualified by a schema)
+
+    FROM inside function calls (EXTRACT(YEAR FROM ...), TRIM(... FROM ...)) is not a table
+    reference; subqueries and derived tables are parsed like the main query.
+    """
+    names = set()
+    _parse_tables(_tokenize(sql), names)
+    return(names)
+
+@lru_cache(maxsize=256)
+def get_referenced_tables(sql, underlying_table=None):
+    """
+    returns the set of tables sql refers to, or None if it refers to a table that is not tracked
+    or its table references cannot be parsed
+    """
+    known = get_model_tables()
+    try:
+        names = parse_table_references(sql)
+    except ValueError:
+        return None
+    if not names <= known:
+        return None
+    tables = names | { table for table in known if re.search(rf'\b{re.escape(table)}\b', sql, re.IGNORECASE) }
+    if underlying_table:
+        tables.add(underlying_table.lower())
+    return frozenset(tables)
+
+def get_result_key(query, sql, params, order_by, tables):
+    tokens = ':'.join(get_table_generation(table) for table in sorted(tables))
+    digest = hashlib.md5(repr((sql, params, order_by, tokens)).encode()).hexdigest()
+    return f'rawquery:result:{query.pk}:{digest}'
+
+def get_cached_result(query, sql, params, order_by, underlying_table, fetch):
+    """
+    returns ( columns, rows ) of the query from the cache, or from fetch() if not cached
+
+    fetch() may return None if the result is too large to be cached; None is then returned
+    and remembered, so the next request does not try again.
+    """
+    tables = get_referenced_tables(query.sql, underlying_table)
+    if tables is None:
+        return None
+    key = get_result_key(query, sql, params, order_by, tables)
+    result = cache.get(key)
+    if result is None:
+        result = fetch() or False
+        cache.set(key, result, settings.RAW_QUERY_RESULT_CACHE_TIMEOUT)
+    return result or None
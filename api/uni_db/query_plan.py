@@ -0,0 +1,87 @@
+"""
+query plans and execution time limits for raw queries
+
+On MariaDB, raw queries are run as SET STATEMENT max_statement_time=... FOR <query>,
+so that the server aborts them after the time allowed instead of keeping a worker busy.
+The limit is RAW_QUERY_MAX_STATEMENT_TIME, or a lower one set on the query itself.
+"""
+
+import json
+
+from django.conf import settings
+from django.db import connection
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+# MariaDB error code: Query execution was interrupted (max_statement_time exceeded)
+ER_STATEMENT_TIMEOUT = 1969
+
+class QueryTimeout(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = 'Query exceeded the maximum execution time.'
+    default_code = 'query_timeout'
+
+def is_mariadb():
+    return connection.vendor == 'mysql' and connection.mysql_is_mariadb
+
+def get_statement_time(query):
+    """
+    maximum execution time of query in seconds
+    """
+    if query.max_statement_time:
+        return min(query.max_statement_time, settings.RAW_QUERY_MAX_STATEMENT_TIME)
+    return settings.RAW_QUERY_MAX_STATEMENT_TIME
+
+def limit_statement_time(sql, seconds):
+    """
+    returns sql wrapped so that MariaDB aborts it after seconds (unchanged on other databases)
+    """
+    if seconds and is_mariadb():
+        return f"SET STATEMENT max_statement_time={int(seconds)} FOR {sql}"
+    return sql
+
+def is_timeout(exc):
+    return bool(exc.args) and exc.args[0] == ER_STATEMENT_TIMEOUT
+
+def explain(sql, params, analyze=False, seconds=None):
+    """
+    returns the query plan of sql as dict, or None if the database does not provide one
+
+    With analyze=True, the query is actually executed (ANALYZE FORMAT=JSON) and the plan
+    includes the rows and time measured, limited to seconds.
+    """
+    if not is_mariadb():
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(limit_statement_time(f"{'ANALYZE' if analyze else 'EXPLAIN'} FORMAT=JSON {sql}", seconds), params)
+        return json.loads(cursor.fetchone()[0])
+
+def _get_tables(node):
+    """
+    tables joined in a query block, not including those of subqueries or derived tables
+    """
+    if isinstance(node, list):
+        for item in node:
+            yield from _get_tables(item)
+    elif isinstance(node, dict):
+        for key, value in node.items():
+            if key == 'table':
+                yield value
+            elif key not in [ 'subqueries', 'materialized' ]:
+                yield from _get_tables(value)
+
+def get_estimate(plan):
+    """
+    returns ( rows, cost ) estimated by the optimizer from a JSON query plan; cost is None
+    if the server does not report it
+    """
+    block = plan.get('query_block', { })
+    cost = block.get('cost', block.get('cost_info', { }).get('query_cost'))
+    rows = None
+    for table in _get_tables(block):
+        table_rows = table.get('rows', table.get('rows_examined_per_scan'))
+        if table_rows is None:
+            continue
+        table_rows = float(table_rows) * float(table.get('filtered', 100)) / 100
+        rows = table_rows if rows is None else rows * table_rows
+    return(None if rows is None else round(rows), None if cost is None else float(cost))
@@ -0,0 +1,46 @@
+import json
+
+from rest_framework import renderers
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework_csv import renderers as csv_renderers
+
+class JSONRenderer(renderers.JSONRenderer):
+    """
+    JSON renderer that can also write a list of rows one by one to a streaming response
+    """
+
+    def render_stream(self, rows, renderer_context={}):
+        separator = b'['
+        for row in rows:
+            yield separator + super().render(row, renderer_context=renderer_context)
+            separator = b','
+        yield b']' if separator == b',' else b'[]'
+
+class PaginatedCSVRenderer(csv_renderers.PaginatedCSVRenderer):
+    """
+    CSV renderer that can also write rows one by one to a streaming response
+    """
+
+    def render_stream(self, rows, renderer_context={}):
+        return csv_renderers.CSVStreamingRenderer().render((row for row in rows), renderer_context=renderer_context)
+
+class JSONLinesRenderer(BaseRenderer):
+    """
+    Renderer which returns one JSON object per line (JSON Lines)
+    """
+    media_type = 'application/x-ndjson'
+    format = 'jsonl'
+    charset = 'utf-8'
+    results_field = 'results'
+
+    def render(self, data, media_type=None, renderer_context={}):
+        if data is None:
+            return b''
+        if isinstance(data, dict):
+            data = data.get(self.results_field, [ data ])
+        return b''.join(self.render_stream(data, renderer_context))
+
+    def render_stream(self, rows, renderer_context={}):
+        for row in rows:
+            yield (json.dumps(row, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')) + '\n').encode(self.charset)
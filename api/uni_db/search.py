@@ -0,0 +1,178 @@
+"""
+full-text search for the generic table search
+
+Views using FullTextSearchFilter opt in per field by listing a subset of their search_fields
+as fulltext_search_fields; these are registered per model at startup.
+For each record, the values of these fields - including those of related records - are
+stored in one text column of SearchIndex, which has a FULLTEXT index on MariaDB.
+
+The index of a model is built by the updatesearchindex command; until then, the model is
+searched with LIKE. Once built, its entries are updated whenever a record, or a related
+record one of its search fields refers to, is saved or deleted.
+"""
+
+import operator
+import re
+
+from functools import lru_cache, reduce
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from rest_framework.filters import SearchFilter, distinct
+
+from uni_db.models import SearchIndex
+from uni_db.query_cache import invalidate_model
+
+_search_fields = { }
+_built = set()
+
+def register(model, fields):
+    """
+    adds fields to the indexed fields of model
+    """
+    indexed = _search_fields.setdefault(model, [ ])
+    for field in fields:
+        if field not in indexed:
+            indexed.append(field)
+    get_dependencies.cache_clear()
+
+def register_views(views):
+    """
+    registers the fulltext_search_fields of all views that use FullTextSearchFilter
+    """
+    for view in views:
+        if FullTextSearchFilter in getattr(view, 'filter_backends', [ ]) and getattr(view, 'fulltext_search_fields', None):
+            register(view.queryset.model, view.fulltext_search_fields)
+
+def get_indexed_models():
+    return(list(_search_fields))
+
+def is_built(model):
+    """
+    whether the index of model has been built, i.e. has entries
+    """
+    if model not in _built and SearchIndex.objects.filter(model=model._meta.label_lower).exists():
+        # an index is only ever rebuilt in place, so it is not checked again
+        _built.add(model)
+    return(model in _built)
+
+@lru_cache(maxsize=None)
+def get_dependencies(model):
+    """
+    returns list( ( [indexed model], [lookup] ), ... ) of indexed models whose text depends
+    on model; lookup leads from the indexed model to model, or is None for model itself
+    """
+    dependencies = [ ]
+    for indexed, fields in _search_fields.items():
+        if indexed is model:
+            dependencies.append((indexed, None))
+        for field in fields:
+            parts = field.split('__')
+            this = indexed
+            for i, part in enumerate(parts[:-1]):
+                this = this._meta.get_field(part).related_model
+                lookup = '__'.join(parts[:i+1])
+                if this is model and (indexed, lookup) not in dependencies:
+                    dependencies.append((indexed, lookup))
+    return(dependencies)
+
+def get_texts(model, pks):
+    """
+    returns dict( [pk]: [text], ... ) for the records of model with primary key in pks
+    """
+    values = { }
+    for row in model._default_manager.filter(pk__in=pks).values_list('pk', *_search_fields[model]):
+        values.setdefault(row[0], [ ]).extend(str(value) for value in row[1:] if value not in [ None, '' ])
+    return({ pk: ' '.join(texts) for pk, texts in values.items() })
+
+def update_index(model, pks):
+    """
+    updates the index entries of records of model with primary key in pks where their text
+    changed, removing those of records that no longer exist
+    """
+    label = model._meta.label_lower
+    texts = { str(pk): text for pk, text in get_texts(model, pks).items() }
+    entries = SearchIndex.objects.filter(model=label, object_id__in=[ str(pk) for pk in pks ])
+    existing = dict(entries.values_list('object_id', 'text'))
+    changed = [ object_id for object_id, text in texts.items() if object_id in existing and existing[object_id] != text ]
+    for object_id in changed:
+        SearchIndex.objects.filter(model=label, object_id=object_id).update(text=texts[object_id])
+    added = [ SearchIndex(model=label, object_id=object_id, text=text) for object_id, text in texts.items() if object_id not in existing ]
+    SearchIndex.objects.bulk_create(added)
+    removed = set(existing) - set(texts)
+    if removed:
+        entries.filter(object_id__in=removed).delete()
+    if changed or added:
+        # updates and bulk inserts send no signals to the raw query cache
+        invalidate_model(SearchIndex)
+
+def update_search_index(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    for model, lookup in get_dependencies(sender):
+        if not is_built(model):
+            # entries of single records would make the index look complete
+            continue
+        if lookup is None:
+            update_index(model, [ instance.pk ])
+        else:
+            update_index(model, list(model._default_manager.filter(**{ lookup: instance.pk }).values_list('pk', flat=True)))
+
+def is_indexed_term(term):
+    """
+    terms shorter than SEARCH_FULLTEXT_MIN_LENGTH or with other characters than letters and
+    digits cannot be found in the index
+    """
+    return(bool(re.fullmatch(r'\w+', term)) and len(term) >= settings.SEARCH_FULLTEXT_MIN_LENGTH)
+
+def search(model, terms):
+    """
+    returns a queryset of the primary keys of records of model with words beginning with each of terms
+    """
+    query = ' '.join(f'+{term}*' for term in terms)
+    return(SearchIndex.objects.filter(model=model._meta.label_lower)
+                              .extra(where=[ 'MATCH (`text`) AGAINST (%s IN BOOLEAN MODE)' ], params=[ query ])
+                              .values('object_id'))
+
+class FullTextSearchFilter(SearchFilter):
+    """
+    SearchFilter that looks up terms in the full-text index on MariaDB, for the fields a view
+    lists in fulltext_search_fields
+
+    The index matches words beginning with a term, rather than any substring like LIKE does,
+    so views only opt in for fields where this is expected (e.g. free text, but not phone
+    numbers or acronyms). The other search_fields are still searched with LIKE, as are all
+    fields for terms that are not indexed (see is_indexed_term), on other databases and for
+    models whose index is not built.
+    """
+
+    def get_fulltext_fields(self, view, queryset, search_fields):
+        fields = [ field for field in getattr(view, 'fulltext_search_fields', [ ]) if field in search_fields ]
+        # the index holds the text of all registered fields, so it can only stand in for exactly these
+        if connection.vendor != 'mysql' or not fields or set(fields) != set(_search_fields.get(queryset.model, [ ])) or not is_built(queryset.model):
+            return([ ])
+        return(fields)
+
+    def filter_queryset(self, request, queryset, view):
+        search_fields = self.get_search_fields(view, request)
+        terms = self.get_search_terms(request)
+        if not search_fields or not terms:
+            return(queryset)
+        fulltext_fields = self.get_fulltext_fields(view, queryset, search_fields)
+        like_fields = [ field for field in search_fields if field not in fulltext_fields ]
+        base = queryset
+        conditions = [ ]
+        used = set()
+        for term in terms:
+            indexed = fulltext_fields and is_indexed_term(term)
+            fields = like_fields if indexed else search_fields
+            queries = [ Q(**{ self.construct_search(str(field)): term }) for field in fields ]
+            if indexed:
+                queries.append(Q(pk__in=search(queryset.model, [ term ])))
+            conditions.append(reduce(operator.or_, queries))
+            used.update(fields)
+        queryset = queryset.filter(reduce(operator.and_, conditions))
+        if self.must_call_distinct(queryset, list(used)):
+            queryset = distinct(queryset, base)
+        return(queryset)
@@ -1,11 +1,41 @@
+import copy
+
 from django.core.exceptions import ValidationError, NON_FIELD_ERRORS
-from django.db.models import Manager
+from django.db.models import Count, IntegerField, Manager, OuterRef, Subquery
+from django.db.models.fields.related_descriptors import ManyToManyDescriptor, ReverseManyToOneDescriptor, ReverseOneToOneDescriptor
+from django.db.models.functions import Coalesce
 
 from rest_framework import serializers
 from rest_framework.settings import api_settings
 
 from uni_db.fields import EnumField
 
+def get_reverse_relation(model, name):
+    """
+    returns ( field, unique ) for reverse relation name of model, field being the foreign
+    key (or one-to-one field) on the related model - or ( None, None ) if it is none
+    """
+    descriptor = getattr(model, name, None)
+    if isinstance(descriptor, ReverseOneToOneDescriptor):
+        return(descriptor.related.field, True)
+    elif isinstance(descriptor, ReverseManyToOneDescriptor) and not isinstance(descriptor, ManyToManyDescriptor):
+        return(descriptor.field, False)
+    else:
+        return(None, None)
+
+def annotate_relation_counts(queryset, relations):
+    """
+    annotates record counts of reverse relations as _count_[relation], one subquery each
+    """
+    annotations = { }
+    for name in relations:
+        field, unique = get_reverse_relation(queryset.model, name)
+        if field:
+            counts = field.model._default_manager.filter(**{ field.name: OuterRef(field.target_field.name) }) \
+                                                 .order_by().values(field.name).annotate(count=Count('*')).values('count')
+            annotations[f'_count_{name}'] = Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+    return(queryset.annotate(**annotations))
+
 class StringRelatedField(serializers.StringRelatedField):
     def __init__(self, *args, **kwargs):
         kwargs.pop('limit_choices_to', None)
@@ -16,7 +46,18 @@ class PrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
         self.limit_choices_to = kwargs.pop('limit_choices_to', None)
         super().__init__(*args, **kwargs)
 
-class ListSerializer(serializers.ModelSerializer):
+class CachedFieldsMixin:
+    """
+    introspects the model only once per serializer class and hands out copies of the fields
+    """
+
+    def get_fields(self):
+        cls = self.__class__
+        if '_cached_fields' not in cls.__dict__:
+            cls._cached_fields = super().get_fields()
+        return copy.deepcopy(cls._cached_fields)
+
+class ListSerializer(CachedFieldsMixin, serializers.ModelSerializer):
     """
     default serializer for list view
 
@@ -37,7 +78,7 @@ class ListSerializer(serializers.ModelSerializer):
     def build_relational_field(self, field_name, relation_info):
         return( (StringRelatedField, { 'read_only': True }) )
 
-class DetailSerializer(serializers.ModelSerializer):
+class DetailSerializer(CachedFieldsMixin, serializers.ModelSerializer):
     """
     default serializer for detail view
 
@@ -78,6 +119,17 @@ class DetailSerializer(serializers.ModelSerializer):
                     relation_model = getattr(obj._meta.model, f)
                 except AttributeError:
                     raise Exception(f"Unknown field in relations_count: `{f}` in `{obj._meta.object_name}` object")
+                field, unique = get_reverse_relation(obj._meta.model, f)
+                if hasattr(obj, f'_count_{f}') and field:
+                    # count annotated by annotate_relation_counts
+                    reverse.append({
+                        "relatedTable": field.model._meta.object_name.lower(),
+                        "count": getattr(obj, f'_count_{f}'),
+                        "column": field.target_field.name,
+                        "relatedColumn": field.name,
+                        "unique": unique,
+                        "value": getattr(obj, field.target_field.name)
+                    })
                 else:
                     try:
                         relation = getattr(obj, f)
@@ -1,3 +1,94 @@
+import datetime
+from urllib.parse import parse_qs, urlparse
+
+from django.db.models import Count, F
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from contacts.models import Contact
+from uni_db.filters import KeysetPagination, keyset_iterator
+from uni_db.query_cache import get_referenced_tables
+
+class KeysetPaginationTest(TestCase):
+    """
+    cursors must select every record exactly once, in both directions
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        # all within the same millisecond, plus two records with equal mtime
+        base = timezone.make_aware(datetime.datetime(2021, 3, 4, 5, 6, 7, 123000))
+        for i in range(7):
+            contact = Contact.objects.create(firstName=f'First{i}', lastName=f'Last{i % 3}', email=f'contact{i}@example.org')
+            Contact.objects.filter(pk=contact.pk).update(mtime=base + datetime.timedelta(microseconds=min(i, 5) * 100))
+
+    def paginate(self, queryset, **params):
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(queryset, Request(APIRequestFactory().get('/', dict(limit=2, **params))))
+        return ( [ obj.pk for obj in page ], paginator )
+
+    def get_cursor(self, link):
+        return parse_qs(urlparse(link).query)['cursor'][0]
+
+    def assertPagesCover(self, queryset):
+        expected = [ obj.pk for obj in queryset ]
+        seen, paginator = self.paginate(queryset, cursor='')
+        pages = [ seen ]
+        while paginator.get_next_link() and len(pages) <= len(expected):
+            page, paginator = self.paginate(queryset, cursor=self.get_cursor(paginator.get_next_link()))
+            pages.append(page)
+        self.assertEqual(sum(pages, [ ]), expected)
+        while paginator.get_previous_link():
+            page, paginator = self.paginate(queryset, cursor=self.get_cursor(paginator.get_previous_link()))
+            self.assertEqual(page, pages[-2])
+            pages.pop()
+        self.assertEqual(len(pages), 1)
+
+    def test_datetime_ordering(self):
+        for ordering in [ 'mtime', '-mtime' ]:
+            with self.subTest(ordering=ordering):
+                self.assertPagesCover(Contact.objects.order_by(ordering))
+
+    def test_multiple_and_default_ordering(self):
+        self.assertPagesCover(Contact.objects.order_by('lastName', '-firstName'))
+        self.assertPagesCover(Contact.objects.all())
+
+    def test_expression_ordering_is_rejected(self):
+        for queryset in [ Contact.objects.annotate(n=Count('contactorganisation')).order_by('n'), Contact.objects.order_by(F('lastName').asc()) ]:
+            with self.subTest(ordering=queryset.query.order_by):
+                with self.assertRaises(ValidationError):
+                    self.paginate(queryset, cursor='')
+
+    def test_iterator_fallback(self):
+        queryset = Contact.objects.annotate(n=Count('contactorganisation')).order_by('n', 'pk')
+        self.assertEqual([ obj.pk for obj in keyset_iterator(queryset, 3) ], [ obj.pk for obj in queryset ])
+        queryset = Contact.objects.order_by('-mtime')
+        self.assertEqual([ obj.pk for obj in keyset_iterator(queryset, 3) ], [ obj.pk for obj in queryset ])
+
+class ReferencedTablesTest(TestCase):
+    """
+    raw queries are only cached if all tables they read from are known
+    """
+
+    def assertTables(self, sql, tables):
+        result = get_referenced_tables(sql)
+        self.assertEqual(result if result is None else set(result), tables)
+
+    def test_table_lists(self):
+        self.assertTables('SELECT * FROM applications a, contact c WHERE a.x = c.cid', { 'applications', 'contact' })
+        self.assertTables('SELECT * FROM applications a JOIN contact c ON a.x = c.cid, organisation o', { 'applications', 'contact', 'organisation' })
+        self.assertTables('SELECT * FROM (SELECT aid FROM applications) AS x, `registeredagency` r ORDER BY 1', { 'applications', 'registeredagency' })
+
+    def test_not_table_references(self):
+        self.assertTables("SELECT EXTRACT(YEAR FROM decisionDate), 'FROM x' FROM applications /* FROM y */", { 'applications' })
 
-# Create your tests here.
+    def test_unknown_tables(self):
+        for sql in [ 'SELECT * FROM applications, mysql.user',
+                     'SELECT * FROM applications a JOIN contact c ON a.x IN (1, 2), unknown',
+                     'SELECT aid FROM applications WHERE EXISTS (SELECT 1 FROM unknown)',
+                     'SELECT * FROM' ]:
+            with self.subTest(sql=sql):
+                self.assertTables(sql, None)
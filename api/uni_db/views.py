@@ -1,14 +1,24 @@
+import hashlib
+
+from calendar import timegm
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
 from rest_framework import viewsets, permissions
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.generics import get_object_or_404
 
 from uni_db.metadata import ExtendedMetadata
-from uni_db.mixins import ReadWriteSerializerMixin
-from uni_db.filters import FilterBackend
-from uni_db.serializers import ListSerializer, DetailSerializer
+from uni_db.mixins import ReadWriteSerializerMixin, StreamingDownloadMixin
+from uni_db.filters import FilterBackend, keyset_iterator
+from uni_db.labels import get_generation, get_related_lookups, get_label_models
+from uni_db.serializers import ListSerializer, DetailSerializer, annotate_relation_counts
 from uni_db.permissions import IsSuperUser, AllowReadOnly
+from uni_db.search import FullTextSearchFilter
 
 class ModelViewSet(ReadWriteSerializerMixin, viewsets.ModelViewSet):
     """
@@ -16,7 +26,7 @@ class ModelViewSet(ReadWriteSerializerMixin, viewsets.ModelViewSet):
     """
     metadata_class = ExtendedMetadata
     permission_classes = [permissions.IsAuthenticated & (IsSuperUser | AllowReadOnly) ]
-    filter_backends = [FilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [FilterBackend, FullTextSearchFilter, OrderingFilter]
 
     def get_field_order(self):
         return [ i.name for i in self.get_queryset().model._meta.fields ]
@@ -61,76 +71,161 @@ class ModelViewSet(ReadWriteSerializerMixin, viewsets.ModelViewSet):
         return obj
 
 
-class UniModelViewSet(ModelViewSet):
+_serializer_classes = { }
+_related_lookups = { }
+
+class UniModelViewSet(StreamingDownloadMixin, ModelViewSet):
     """
     extended ModelViewSet that generates serializers automatically
+
+    For list, select and download, related records needed for string representations
+    are fetched along with the main query (see get_related_lookups). For retrieve, counts
+    of relations_count are annotated (see annotate_relation_counts).
+
+    List and retrieve send an ETag for models with an mtime field, and answer If-None-Match
+    with 304 Not Modified before serializing anything. If-Modified-Since is not answered: the
+    latest mtime does not change when records are deleted or related labels change.
     """
 
+    def list(self, request, *args, **kwargs):
+        if not self.has_mtime():
+            return super().list(request, *args, **kwargs)
+        state = self.filter_queryset(self.get_queryset()).order_by().aggregate(mtime=Max('mtime'), count=Count('pk'))
+        models = get_label_models(self.queryset.model, self.get_rendered_fields())
+        return self.get_conditional_response(None, models, state,
+                                             lambda: super(UniModelViewSet, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.has_mtime():
+            return super().retrieve(request, *args, **kwargs)
+        instance = self.get_object()
+        # related records are rendered by their labels, and those referring to this one are counted in _related
+        model = self.queryset.model
+        models = get_label_models(model, [ field.name for field in model._meta.fields + model._meta.many_to_many ])
+        models += [ relation.related_model for relation in model._meta.related_objects if relation.related_model not in models ]
+        return self.get_conditional_response(instance.mtime, models, dict(pk=instance.pk, mtime=instance.mtime),
+                                             lambda: Response(self.get_serializer(instance).data))
+
+    def has_mtime(self):
+        return(any(field.name == 'mtime' for field in self.queryset.model._meta.fields))
+
+    def get_conditional_response(self, last_modified, models, state, respond):
+        """
+        returns 304 Not Modified if the client's copy is current, otherwise respond()
+
+        The ETag covers state, the label generations of models (which change with the records
+        the response refers to), the requested URL and the renderer format. last_modified, if
+        given, is only sent for information.
+        """
+        generations = [ get_generation(model) for model in models ]
+        key = repr((state, generations, self.request.get_full_path(), self.request.accepted_renderer.format))
+        etag = quote_etag(hashlib.md5(key.encode()).hexdigest())
+        response = get_conditional_response(self.request, etag=etag)
+        if response is None:
+            response = respond()
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(timegm(last_modified.utctimetuple()))
+        return(response)
+
     @action(detail=True, methods=['get'])
     def nested(self, request, pk=None):
-        obj = self.queryset.get(pk=pk)
+        obj = self.get_queryset().get(pk=pk)
         serializer = self.get_nested_serializer_class()
         return Response(serializer(obj).data)
 
     @action(detail=False, methods=['get'])
     def select(self, request):
-        results = self.filter_queryset(self.queryset)
+        results = self.filter_queryset(self.get_queryset())
         serializer = self.get_search_serializer_class()
         return Response(serializer(results, many=True).data)
 
     @action(detail=False, methods=['get'])
     def download(self, request):
-        results = self.filter_queryset(self.queryset)
+        results = self.filter_queryset(self.get_queryset())
         serializer = self.get_download_serializer_class()
+        if self.is_streaming():
+            serializer = serializer()
+            return self.get_streaming_response(serializer.to_representation(obj) for obj in keyset_iterator(results, self.stream_chunk_size))
         return Response(serializer(results, many=True).data)
 
-    def _add_limit_choices_to(self, target):
-        for field, q in getattr(self, 'limit_choices_to', {}).items():
-            if field in target.Meta.extra_kwargs:
-                target.Meta.extra_kwargs[field]['limit_choices_to'] = q
-            else:
-                target.Meta.extra_kwargs[field] = { 'limit_choices_to': q }
-
-    def _make_serializer_class(self, baseclass, ref_name, details):
-
-        class ThisSerializer(baseclass):
-            class Meta:
-                pass
-
-        ThisSerializer.Meta.model = self.queryset.model
-        ThisSerializer.Meta.ref_name = f'{self.queryset.model._meta.model_name}-{ref_name}'
-        ThisSerializer.Meta.extra_kwargs = getattr(self, 'extra_kwargs', dict())
-        if details:
-            ThisSerializer.Meta.fields = '__all__'
+    def get_rendered_fields(self):
+        """
+        model fields that are rendered by the current action (in addition to __str__)
+        """
+        model = self.queryset.model
+        all_fields = [ field.name for field in model._meta.fields + model._meta.many_to_many ]
+        if self.action == 'list':
+            fields = getattr(self, 'list_fields', '__all__')
+            return(all_fields if fields == '__all__' else fields)
+        elif self.action == 'download':
+            return(all_fields)
         else:
-            ThisSerializer.Meta.fields = getattr(self, 'list_fields', '__all__')
-        return(ThisSerializer)
+            return([ ])
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if getattr(self, 'action', None) in [ 'list', 'select', 'download' ]:
+            key = (self.__class__, self.action)
+            if key not in _related_lookups:
+                _related_lookups[key] = get_related_lookups(queryset.model, self.get_rendered_fields())
+            select_related, prefetch_related = _related_lookups[key]
+            queryset = queryset.select_related(*select_related).prefetch_related(*prefetch_related)
+        elif getattr(self, 'action', None) == 'retrieve' and hasattr(self, 'relations_count'):
+            # only the read serializer renders _related: the write and nested serializers have no relations_count
+            queryset = annotate_relation_counts(queryset, self.relations_count)
+        return(queryset)
+
+    def _get_extra_kwargs(self, limit_choices=False):
+        """
+        copy of extra_kwargs, with limit_choices_to added to the respective fields if requested
+        """
+        extra_kwargs = { field: dict(kwargs) for field, kwargs in getattr(self, 'extra_kwargs', dict()).items() }
+        if limit_choices:
+            for field, q in getattr(self, 'limit_choices_to', {}).items():
+                extra_kwargs.setdefault(field, {})['limit_choices_to'] = q
+        return(extra_kwargs)
+
+    def _make_serializer_class(self, baseclass, ref_name, details, limit_choices=False, **options):
+        """
+        generates a serializer class - once per viewset class, then it is taken from the cache
+        """
+        key = (self.__class__, ref_name)
+        if key not in _serializer_classes:
+
+            class ThisSerializer(baseclass):
+                class Meta:
+                    pass
+
+            ThisSerializer.Meta.model = self.queryset.model
+            ThisSerializer.Meta.ref_name = f'{self.queryset.model._meta.model_name}-{ref_name}'
+            ThisSerializer.Meta.extra_kwargs = self._get_extra_kwargs(limit_choices)
+            if details:
+                ThisSerializer.Meta.fields = '__all__'
+            else:
+                fields = getattr(self, 'list_fields', '__all__')
+                ThisSerializer.Meta.fields = list(fields) if isinstance(fields, (list, tuple)) else fields
+            for option, value in options.items():
+                setattr(ThisSerializer.Meta, option, value)
+            _serializer_classes[key] = ThisSerializer
+        return(_serializer_classes[key])
 
     def get_list_serializer_class(self):
         return(self._make_serializer_class(ListSerializer, 'list', False))
 
     def get_search_serializer_class(self):
-        SearchSerializer = self._make_serializer_class(ListSerializer, 'search', False)
-        SearchSerializer.Meta.fields = [ '_label' ]
-        return(SearchSerializer)
+        return(self._make_serializer_class(ListSerializer, 'search', False, fields=[ '_label' ]))
 
     def get_download_serializer_class(self):
         return(self._make_serializer_class(ListSerializer, 'download', True))
 
     def get_read_serializer_class(self):
-        ReadSerializer = self._make_serializer_class(DetailSerializer, 'detail', True)
         if hasattr(self, 'relations_count'):
-            ReadSerializer.Meta.relations_count = self.relations_count
-        self._add_limit_choices_to(ReadSerializer)
-        return(ReadSerializer)
+            return(self._make_serializer_class(DetailSerializer, 'detail', True, limit_choices=True, relations_count=self.relations_count))
+        return(self._make_serializer_class(DetailSerializer, 'detail', True, limit_choices=True))
 
     def get_nested_serializer_class(self):
-        NestedSerializer = self._make_serializer_class(DetailSerializer, 'nested', True)
-        NestedSerializer.Meta.depth = 2
-        return(NestedSerializer)
+        return(self._make_serializer_class(DetailSerializer, 'nested', True, depth=2))
 
     def get_write_serializer_class(self):
-        WriteSerializer = self._make_serializer_class(DetailSerializer, 'write', True)
-        self._add_limit_choices_to(WriteSerializer)
-        return(WriteSerializer)
-
+        return(self._make_serializer_class(DetailSerializer, 'write', True, limit_choices=True))
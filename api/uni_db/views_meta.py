@@ -1,24 +1,34 @@
+import hashlib
+import json
 import re
 
 from django.urls import path, include
 from django.contrib import auth
-from django.db import connection
-from django.db.models import Q
+from django.core.cache import cache
+from django.db import connection, DatabaseError
+from django.db.models import Count, Q, Window
 from django.conf import settings
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 
 from rest_framework import status, generics, views, viewsets, permissions, routers, serializers
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from rest_framework.exceptions import PermissionDenied
+from rest_framework.utils.encoders import JSONEncoder
 
 from members.views import *
 from contacts.views import *
 from agencies.views import *
 
 from uni_db.filters import SearchFacetPagination
-from uni_db.mixins import ReadWriteSerializerMixin
+from uni_db.labels import get_labels
+from uni_db.mixins import ReadWriteSerializerMixin, StreamingDownloadMixin
 from uni_db.models import RawQuery
 from uni_db.permissions import ObjectOwnerOrReadOnly, AllowReadOnly
+from uni_db.query_cache import get_cached_result, invalidate_model
+from uni_db.search import FullTextSearchFilter
+from uni_db.query_plan import QueryTimeout, explain, get_estimate, get_statement_time, limit_statement_time, is_timeout
 
 class UniDB:
 
@@ -58,6 +68,9 @@ class UniDB:
     @classmethod
     def system_path(cls):
 
+        # database tables by table name in API (RawQuery.underlying_table)
+        table_names = { routers.DefaultRouter.get_default_basename(None, viewset): viewset.queryset.model._meta.db_table for viewset in cls.Tables }
+
         class QueryWriteSerializer(serializers.ModelSerializer):
             owner = serializers.PrimaryKeyRelatedField(
                 queryset=auth.models.User.objects.all(),
@@ -76,7 +89,7 @@ class UniDB:
             def get_searchable(self, query):
                 return (query.sql.count('%s') > 0)
 
-        class QueryViewset(ReadWriteSerializerMixin, viewsets.ModelViewSet):
+        class QueryViewset(StreamingDownloadMixin, ReadWriteSerializerMixin, viewsets.ModelViewSet):
             """
             List and edit queries
             """
@@ -88,29 +101,174 @@ class UniDB:
             def get_queryset(self):
                 return RawQuery.objects.filter(Q(is_shared=True) | Q(owner=self.request.user))
 
-            def run_query(self, request, pk=None, pagination=True):
-                query = RawQuery.objects.get(pk=pk)
+            def get_sql(self, request, pk):
+                """
+                returns SQL of the query with search applied, its parameters and the ORDER BY
+                clause requested by ?ordering= (empty if none)
+                """
+                query = self.raw_query = RawQuery.objects.get(pk=pk)
                 if not re.match(r'^\s*SELECT', query.sql, re.IGNORECASE):
                     raise PermissionDenied(detail='Raw queries must start with SELECT')
 
                 sql = query.sql
+                order_by = ''
                 ordering = request.query_params.get('ordering')
                 if ordering:
                     sql = re.sub(r'\s+ORDER\s+BY\s+.*$', '', sql, flags=(re.IGNORECASE | re.DOTALL))    # remove ORDER BY if exist
-                    sql += " ORDER BY `" + ( ordering[1:] + "` DESC" if ordering[0] == '-' else ordering + "`") # add new ORDER BY clause
+                    order_by = " ORDER BY `" + ( ordering[1:] + "` DESC" if ordering[0] == '-' else ordering + "`") # new ORDER BY clause
                 search = request.query_params.get('search')
                 if search:
                     sql = re.sub(r'\/\*((\*(?!\/)|[^*])*\%s(\*(?!\/)|[^*])*)\*\/', r'\1', sql)
+                return(sql, [ search ] * sql.count('%s'), order_by)
+
+            def limit_time(self, sql):
+                return limit_statement_time(sql, get_statement_time(self.raw_query))
+
+            def update_estimate(self, query):
+                """
+                stores the number of rows and cost estimated by the optimizer with the query
+                """
+                estimate = ( None, None )
+                try:
+                    sql, params, order_by = self.get_sql(self.request, query.pk)
+                    plan = explain(sql, params)
+                    if plan:
+                        estimate = get_estimate(plan)
+                except (PermissionDenied, DatabaseError):
+                    pass
+                query.estimated_rows, query.estimated_cost = estimate
+                RawQuery.objects.filter(pk=query.pk).update(estimated_rows=query.estimated_rows, estimated_cost=query.estimated_cost)
+                invalidate_model(RawQuery)
+
+            def perform_create(self, serializer):
+                self.update_estimate(serializer.save())
+
+            def perform_update(self, serializer):
+                self.update_estimate(serializer.save())
+
+            def handle_exception(self, exc):
+                if isinstance(exc, DatabaseError) and is_timeout(exc):
+                    exc = QueryTimeout(detail=f'Query exceeded the maximum execution time of {get_statement_time(self.raw_query)} seconds.')
+                return super().handle_exception(exc)
+
+            def get_count(self, pk, sql, params):
+                """
+                number of rows returned by the query, cached for a short time so that paging
+                through the results does not evaluate the full query for each page
+                """
+                count = cache.get(self.get_count_key(pk, sql, params))
+                if count is None:
+                    with connection.cursor() as cursor:
+                        cursor.execute(self.limit_time(sql), params)
+                        count = cursor.rowcount
+                    self.set_count(pk, sql, params, count)
+                return(count)
+
+            def get_count_key(self, pk, sql, params):
+                return f'rawquery:count:{pk}:{hashlib.md5(repr((sql, params)).encode()).hexdigest()}'
+
+            def set_count(self, pk, sql, params, count):
+                cache.set(self.get_count_key(pk, sql, params), count, settings.RAW_QUERY_COUNT_CACHE_TIMEOUT)
+
+            def run_window_query(self, sql, params, order_by, limit, offset):
+                """
+                runs the query as derived table, returning one page and the total count at once
+
+                Returns None if the query has its own ORDER BY (which would not be kept in a
+                derived table) or cannot be used as derived table (e.g. duplicate column names).
+                """
+                if re.search(r'\bORDER\s+BY\b', sql, re.IGNORECASE):
+                    return(None)
+                sql_window = f"SELECT *, COUNT(*) OVER () AS `_count` FROM ({sql}) AS `_query`{order_by} LIMIT {limit} OFFSET {offset}"
+                try:
+                    with connection.cursor() as cursor:
+                        cursor.execute(self.limit_time(sql_window), params)
+                        columns = [ col[0] for col in cursor.description ][:-1]
+                        rows = cursor.fetchall()
+                except DatabaseError as exc:
+                    if is_timeout(exc):
+                        raise
+                    return(None)
+                if rows:
+                    count = rows[0][-1]
+                elif offset > 0:
+                    count = None
+                else:
+                    count = 0
+                return(columns, [ row[:-1] for row in rows ], count)
+
+            def fetch_result(self, sql, params):
+                """
+                returns ( columns, rows ) of the query for the result cache, or None if
+                it returns more than RAW_QUERY_RESULT_CACHE_MAX_ROWS rows
+
+                Rows are read from a streaming cursor, so at most RAW_QUERY_RESULT_CACHE_MAX_ROWS
+                are held in memory. The remaining rows of a larger result are only counted; the
+                first rows and the count are kept in self.oversized_result, so that the current
+                request can take its page from them instead of running the query again.
+                """
+                max_rows = settings.RAW_QUERY_RESULT_CACHE_MAX_ROWS
+                with connection.wrap_database_errors:
+                    cursor = self.get_streaming_cursor()
+                    try:
+                        cursor.execute(self.limit_time(sql), params)
+                        columns = [ col[0] for col in cursor.description ]
+                        rows = cursor.fetchmany(max_rows + 1)
+                        if len(rows) <= max_rows:
+                            return(columns, rows)
+                        count = len(rows)
+                        while True:
+                            chunk = cursor.fetchmany(self.stream_chunk_size)
+                            if not chunk:
+                                break
+                            count += len(chunk)
+                        self.oversized_result = ( columns, rows[:max_rows], count )
+                        return(None)
+                    finally:
+                        cursor.close()
+
+            def run_query(self, request, pk=None, pagination=True):
+                sql, params, order_by = self.get_sql(request, pk)
                 if pagination:
                     limit = int(request.query_params.get('limit', SearchFacetPagination.default_limit))
                     offset = int(request.query_params.get('offset', 0))
-                    sql_window = f"{sql} LIMIT {limit} OFFSET {offset}"
-                with connection.cursor() as cursor:
-                    count = cursor.execute(sql, [ search ] * sql.count('%s') )
+                underlying_table = table_names.get(self.raw_query.underlying_table)
+                self.oversized_result = None
+                cached = get_cached_result(self.raw_query, sql, params, order_by, underlying_table,
+                                           lambda: self.fetch_result(f"{sql}{order_by}", params))
+                head = None
+                if not cached and self.oversized_result:
+                    self.set_count(pk, sql, params, self.oversized_result[2])
+                    if pagination and offset + limit <= len(self.oversized_result[1]):
+                        # too large to be cached, but the page was read while trying
+                        head = self.oversized_result
+                window = None
+                if not cached and not head and pagination:
+                    window = self.run_window_query(sql, params, order_by, limit, offset)
+                if cached:
+                    self.columns, rows = cached
+                    count = len(rows)
                     if pagination:
-                        cursor.execute(sql_window, [ search ] * sql_window.count('%s') )
-                    self.columns = [ col[0] for col in cursor.description ]
-                    results = [ dict(zip(self.columns,row)) for row in cursor.fetchall() ]
+                        rows = rows[offset:offset + limit]
+                elif head:
+                    self.columns, rows, count = head
+                    rows = rows[offset:offset + limit]
+                elif window:
+                    self.columns, rows, count = window
+                    if count is None:
+                        # page beyond the end: no row to take the count from
+                        count = self.get_count(pk, sql, params)
+                else:
+                    with connection.cursor() as cursor:
+                        if pagination:
+                            # the number of rows does not depend on the order
+                            count = self.get_count(pk, sql, params)
+                            cursor.execute(self.limit_time(f"{sql}{order_by} LIMIT {limit} OFFSET {offset}"), params)
+                        else:
+                            count = cursor.execute(self.limit_time(f"{sql}{order_by}"), params)
+                        self.columns = [ col[0] for col in cursor.description ]
+                        rows = cursor.fetchall()
+                results = [ dict(zip(self.columns,row)) for row in rows ]
 
                 return dict(
                     count=count,
@@ -118,15 +276,80 @@ class UniDB:
                     results=results
                 )
 
+            def get_streaming_cursor(self):
+                """
+                on MySQL/MariaDB, an unbuffered server-side cursor, so that rows are read from
+                the server as they are sent on instead of loading the whole result first
+
+                No other query can run on the connection until the cursor is closed.
+                """
+                if connection.vendor == 'mysql':
+                    from MySQLdb.cursors import SSCursor
+                    connection.ensure_connection()
+                    return connection.connection.cursor(SSCursor)
+                return connection.cursor()
+
+            def stream_query(self, request, pk=None):
+                """
+                executes the query and returns a generator that fetches the rows in chunks
+                from a streaming cursor
+
+                The first chunk is fetched before the response starts: a streaming query may
+                only time out while rows are fetched, which can then still be answered with
+                QueryTimeout. Errors while fetching later chunks abort the download.
+                """
+                sql, params, order_by = self.get_sql(request, pk)
+                cursor = self.get_streaming_cursor()
+                try:
+                    # the raw MySQLdb cursor raises driver exceptions, which handle_exception
+                    # would not recognise
+                    with connection.wrap_database_errors:
+                        cursor.execute(self.limit_time(f"{sql}{order_by}"), params)
+                        self.columns = [ col[0] for col in cursor.description ]
+                        chunk = cursor.fetchmany(self.stream_chunk_size)
+                except Exception:
+                    cursor.close()
+                    raise
+                def rows(chunk):
+                    try:
+                        while chunk:
+                            for row in chunk:
+                                yield dict(zip(self.columns, row))
+                            with connection.wrap_database_errors:
+                                chunk = cursor.fetchmany(self.stream_chunk_size)
+                    finally:
+                        cursor.close()
+                return rows(chunk)
+
             def retrieve(self, request, pk=None, format=None):
                 output = self.run_query(request, pk, True)
                 return Response(output, status=status.HTTP_200_OK)
 
             @action(detail=True, methods=['get'])
             def download(self, request, pk=None, format=None):
+                if self.is_streaming():
+                    return self.get_streaming_response(self.stream_query(request, pk))
                 output = self.run_query(request, pk, False)
                 return Response(output['results'], status=status.HTTP_200_OK)
 
+            @action(detail=True, methods=['get'])
+            def explain(self, request, pk=None, format=None):
+                """
+                query plan as estimated by the optimizer, or as measured by running the query
+                with ?analyze=true
+                """
+                sql, params, order_by = self.get_sql(request, pk)
+                analyze = request.query_params.get('analyze') == 'true'
+                plan = explain(f"{sql}{order_by}", params, analyze=analyze, seconds=get_statement_time(self.raw_query))
+                if plan is None:
+                    return Response({ 'detail': 'Query plans are not supported by this database.' }, status=status.HTTP_501_NOT_IMPLEMENTED)
+                estimated_rows, estimated_cost = get_estimate(plan)
+                return Response(dict(
+                    estimated_rows=estimated_rows,
+                    estimated_cost=estimated_cost,
+                    plan=plan
+                ), status=status.HTTP_200_OK)
+
             def get_renderer_context(self):
                 context = super().get_renderer_context()
                 if self.action in [ 'retrieve', 'download' ]:
@@ -137,6 +360,7 @@ class UniDB:
         queries.register('query', QueryViewset, basename='query')
         return([
             path('system/tables/', cls.table_list().as_view()),
+            path('system/search/', cls.global_search().as_view()),
             path('', include(queries.urls))
         ])
 
@@ -146,32 +370,47 @@ class UniDB:
         class TableList(views.APIView):
             """
             List tables available for viewing/editing
+
+            The catalogue only changes on deploy, so it is built once per process and sent
+            with an ETag, allowing clients to revalidate with If-None-Match.
             """
             permission_classes = [permissions.IsAuthenticated]
+            viewsets = cls.Tables
+            catalogue = None
 
-            def get(self, request, format=None):
+            @classmethod
+            def get_catalogue(cls):
+                if cls.catalogue is None:
+                    cls.catalogue = cls.build_catalogue()
+                    cls.catalogue_digest = hashlib.md5(json.dumps(cls.catalogue, sort_keys=True, cls=JSONEncoder).encode()).hexdigest()
+                return cls.catalogue
+
+            @classmethod
+            def build_catalogue(cls):
+                def capitalize_first(text):
+                    return(text[0].upper() + text[1:])
                 tables = dict()
-                for viewset in cls.Tables:
-                    slug = routers.DefaultRouter.get_default_basename(None, viewset)
+                for viewset_class in cls.viewsets:
+                    slug = routers.DefaultRouter.get_default_basename(None, viewset_class)
+                    viewset = viewset_class()
                     if hasattr(viewset, 'get_list_serializer_class'):
-                        list_serializer_class = viewset().get_list_serializer_class()
+                        list_serializer_class = viewset.get_list_serializer_class()
                     elif hasattr(viewset, 'get_read_serializer_class'):
-                        list_serializer_class = viewset().get_read_serializer_class()
+                        list_serializer_class = viewset.get_read_serializer_class()
                     else:
-                        list_serializer_class = viewset().get_serializer_class()
+                        list_serializer_class = viewset.get_serializer_class()
                     list_serializer = list_serializer_class()
                     if hasattr(viewset, 'get_read_serializer_class'):
-                        read_serializer_class = viewset().get_read_serializer_class()
+                        read_serializer_class = viewset.get_read_serializer_class()
                     else:
-                        read_serializer_class = viewset().get_serializer_class()
+                        read_serializer_class = viewset.get_serializer_class()
                     read_serializer = read_serializer_class()
-                    def capitalize_first(text):
-                        return(text[0].upper() + text[1:])
+                    model = viewset.get_queryset().model
                     tables[slug] = dict(
                         name=slug,
-                        description=capitalize_first(viewset().get_queryset().model._meta.verbose_name_plural),
+                        description=capitalize_first(model._meta.verbose_name_plural),
                         section='table',
-                        priKey=viewset().get_queryset().model._meta.pk.name,
+                        priKey=model._meta.pk.name,
                         searchable=hasattr(viewset, 'search_fields'),
                         underlyingTable=None,
                         columns={ i: list_serializer.fields[i].label for i in list_serializer.fields },
@@ -189,11 +428,74 @@ class UniDB:
                         tables[slug]['allowEdit'] = options.get('update', True)
                         tables[slug]['allowDelete'] = options.get('delete', True)
 
-                return Response(dict(
+                return dict(
                     UniDB_motd=f'Connected: {settings.UNI_DB_TITLE}',
                     uiconfig=dict(pagetitle=settings.UNI_DB_TITLE, cuttext=60, pagesize=SearchFacetPagination.default_limit),
                     tables=tables
-                ), status=status.HTTP_200_OK)
+                )
+
+            def get(self, request, format=None):
+                catalogue = self.get_catalogue()
+                # the representation depends on the renderer, too
+                etag = quote_etag(f'{self.catalogue_digest}-{request.accepted_renderer.format}')
+                response = get_conditional_response(request, etag=etag)
+                if response is None:
+                    response = Response(catalogue, status=status.HTTP_200_OK)
+                response['ETag'] = etag
+                return response
 
         return(TableList)
 
+    @classmethod
+    def global_search(cls):
+
+        class GlobalSearch(views.APIView):
+            """
+            Search all tables included in global search at once, returning the number of
+            matching records and the first hits of each table
+
+            Each table takes a single query, the count is computed along with the hits - unless
+            the search needs DISTINCT (across to-many relations), which a window count would not
+            respect; it is then counted separately.
+            """
+            permission_classes = [permissions.IsAuthenticated]
+            viewsets = [ viewset for viewset in cls.Tables if hasattr(viewset, 'search_fields') and getattr(viewset, 'unidb_options', {}).get('includeGlobalSearch', True) ]
+            search_param = 'q'
+            default_limit = 10
+            max_limit = 100
+
+            def search_table(self, request, viewset, limit):
+                model = viewset.queryset.model
+                view = viewset(request=request, format_kwarg=None, action='list')
+                search = FullTextSearchFilter()
+                search.search_param = self.search_param
+                queryset = search.filter_queryset(request, view.get_queryset(), view).prefetch_related(None)
+                if queryset.query.distinct:
+                    hits = list(queryset.values_list('pk', flat=True)[:limit])
+                    count = queryset.count() if len(hits) == limit else len(hits)
+                else:
+                    rows = list(queryset.annotate(_count=Window(expression=Count('pk'))).values_list('pk', '_count')[:limit])
+                    hits = [ pk for pk, count in rows ]
+                    count = rows[0][1] if rows else 0
+                labels = get_labels(model, hits)
+                return dict(
+                    count=count,
+                    results=[ { model._meta.pk.name: pk, '_label': labels.get(pk) } for pk in hits ]
+                )
+
+            def get(self, request, format=None):
+                q = request.query_params.get(self.search_param, '').strip()
+                if not q:
+                    raise serializers.ValidationError({ self.search_param: 'This parameter is required.' })
+                try:
+                    limit = min(int(request.query_params.get('limit', self.default_limit)), self.max_limit)
+                except ValueError:
+                    raise serializers.ValidationError({ 'limit': 'A valid integer is required.' })
+                results = dict()
+                for viewset in self.viewsets:
+                    slug = routers.DefaultRouter.get_default_basename(None, viewset)
+                    results[slug] = self.search_table(request, viewset, limit)
+                return Response(dict(q=q, results=results), status=status.HTTP_200_OK)
+
+        return(GlobalSearch)
+